@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+
+import harmony
+
+# Constants
+ARTIFACTS_DIR = "artifacts"
+
+# Builds kept on disk; the previous one stays so pages opened before a swap can still load its images
+KEEP_VERSIONS = 2
+
+def list_artifacts(data):
+    # (key, kind, title, render function, arguments) for every choice of the visualization and sub dropdowns
+    artifacts = [
+        ("composer_names_wordcloud", "wordcloud", "Composer Names Word Cloud", harmony.draw_wordcloud, (data.word_frequencies["composer"], harmony.FACE_IMG_PATH)),
+        ("composition_names_wordcloud", "wordcloud", "Piece Titles Word Cloud", harmony.draw_wordcloud, (data.word_frequencies["composition"], harmony.MUSIC_IMG_PATH)),
+    ]
+    for category in harmony.TOP_10_CATEGORIES:
+        artifacts.append((harmony.visualization_key("top_10", category), "top_10", None, harmony.top_10_figure, (data.top_10_data[category], category)))
+    for x_key, y_key in harmony.FREQUENCY_PAIRS:
+        for top_n in harmony.FREQUENCY_TOP_N_OPTIONS:
+            table = harmony.fold_frequency_table(data.frequency_data[(x_key, y_key)], top_n)
+            artifacts.append((harmony.visualization_key(f"frequency_{x_key}_{y_key}", None, top_n), "frequency", None, harmony.frequency_figure, (table, x_key, y_key)))
+    return artifacts
+
+def render_artifact(function, args):
+    # Runs in a build process: word clouds come back as PNG bytes, figures as their Plotly JSON spec
+    result = function(*args)
+    return result if isinstance(result, bytes) else result.to_json().encode("utf-8")
+
+def artifact_file_name(key, kind):
+    return re.sub(r"\W+", "-", key) + (".png" if kind == "wordcloud" else ".json")
+
+def write_file(path, contents):
+    # Written to a temporary file first so a server never reads a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(contents)
+    os.replace(tmp_path, path)
+
+def prune_versions(out_dir, current_version):
+    builds = [entry for entry in os.listdir(out_dir) if os.path.isdir(os.path.join(out_dir, entry)) and not entry.endswith(".tmp")]
+    builds.sort(key=lambda entry: (entry == current_version, os.path.getmtime(os.path.join(out_dir, entry))), reverse=True)
+    for entry in builds[KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(out_dir, entry), ignore_errors=True)
+
+def build_artifacts(out_dir, processes=None, force=False):
+    start = time.perf_counter()
+    data = harmony.load_snapshot()
+    version_dir = os.path.join(out_dir, data.version)
+
+    if os.path.isdir(version_dir) and not force:
+        print(f"Artifacts for database version {data.version} are already built.")
+    else:
+        # Rendered into a temporary directory and renamed when complete, so a build is never served half done
+        tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir)
+        manifest = {"version": data.version, "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "artifacts": {}}
+
+        try:
+            # Every visualization is independent, so each one renders on its own core
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [(key, kind, title, executor.submit(render_artifact, function, args)) for key, kind, title, function, args in list_artifacts(data)]
+                for key, kind, title, future in futures:
+                    file_name = artifact_file_name(key, kind)
+                    with open(os.path.join(tmp_dir, file_name), "wb") as f:
+                        f.write(future.result())
+                    manifest["artifacts"][key] = {"kind": kind, "file": file_name, "title": title}
+
+            with open(os.path.join(tmp_dir, harmony.ARTIFACTS_MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.replace(tmp_dir, version_dir)
+        print(f"Built {len(manifest['artifacts'])} artifacts for database version {data.version} in {time.perf_counter() - start:.1f} s.")
+
+    write_file(os.path.join(out_dir, harmony.ARTIFACTS_POINTER), data.version.encode("utf-8"))
+    prune_versions(out_dir, data.version)
+    return data.version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render every dashboard visualization for harmony.py --static.")
+    parser.add_argument("--db", default=harmony.DB_FILE_PATH, help="database to render from")
+    parser.add_argument("--out", default=ARTIFACTS_DIR, help="directory that keeps one subdirectory per build")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="visualizations rendered in parallel")
+    parser.add_argument("--force", action="store_true", help="rebuild even if this database version is already built")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"database not found: {args.db}")
+
+    harmony.DB_FILE_PATH = args.db
+    os.makedirs(args.out, exist_ok=True)
+    build_artifacts(args.out, args.processes, args.force)
@@ -0,0 +1,22 @@
+import multiprocessing
+
+# Production server settings for harmony.py: gunicorn -c gunicorn.conf.py wsgi:application
+bind = "0.0.0.0:8050"
+
+# The app and its data are loaded once in the master and shared copy-on-write by the forked workers
+preload_app = True
+workers = multiprocessing.cpu_count()
+
+# Threads keep serving cached figures and explorer pages while a render runs in a background job or render process
+worker_class = "gthread"
+threads = 4
+
+# The first render of a large word cloud can take a while
+timeout = 120
+
+def post_fork(server, worker):
+    # Each worker starts its render processes at boot instead of on its first request. Static mode renders nothing,
+    # and with background callbacks the slow renders run in the job processes instead
+    import harmony
+    if harmony.artifact_store is None and harmony.background_cache is None:
+        harmony.render_pool.start()
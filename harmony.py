@@ -1,10 +1,33 @@
-import sqlite3
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
-from collections import Counter, defaultdict
+import metrics
+import queries
+from contextlib import closing
+from dash import Dash, DiskcacheManager, ctx, dcc, html, no_update
+from dash.dependencies import Input, Output, State
+from collections import namedtuple, defaultdict, Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import send_from_directory
 import plotly.express as px
-from wordcloud import WordCloud
+from wordcloud import WordCloud, STOPWORDS
+import argparse
 import base64
+import cProfile
+import diskcache
+import gc
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import psutil
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from functools import lru_cache, wraps
+from operator import itemgetter
 from io import BytesIO
 from PIL import Image
 import numpy as np
@@ -15,120 +38,565 @@ DB_FILE_PATH = "database/harmony.db"
 FACE_IMG_PATH = "media/face.png"
 MUSIC_IMG_PATH = "media/music.png"
 
-def fetch_data():
-    # Connect to the SQLite database and fetch data
-    conn = sqlite3.connect(DB_FILE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT full_name FROM composers")
-    composers_data = cursor.fetchall()
-
-    cursor.execute('''SELECT 
-                    compositions.full_name,
-                    compositions.work_title,
-                    composers.full_name AS composer_name, 
-                    keys.name AS key, 
-                    instrumentations.name AS instrumentation, 
-                    styles.name AS piece_style, 
-                    languages.name AS language
-                  FROM compositions
-                    LEFT JOIN composers ON compositions.composer_id = composers.id
-                    LEFT JOIN keys ON compositions.key_id = keys.id
-                    LEFT JOIN instrumentations ON compositions.instrumentation_id = instrumentations.id
-                    LEFT JOIN styles ON compositions.piece_style_id = styles.id
-                    LEFT JOIN languages ON compositions.language_id = languages.id''')
-
-    compositions_data = cursor.fetchall()
-
-    conn.close()
-
-    return composers_data, compositions_data
-
-def extract_data(composers_data, compositions_data):
-    # Extract nested information with error handling
-    composers = [{"full_name": entry[0]} for entry in composers_data]
-    compositions = [{key: value if value is not None else "" for key, value in zip(["full_name", "Work Title", "composer", "Key", "Instrumentation", "Piece Style", "Language"], entry)} for entry in compositions_data]
-    composer_names = [entry["full_name"] for entry in composers]
-    composition_names = [entry["Work Title"] for entry in compositions]
-
-    return composers, compositions, composer_names, composition_names
-
-def create_dash_app():
+# Word clouds are drawn from word counts the scraper keeps in the WordCounts table.
+# Databases from before that table are counted here, splitting text the way WordCloud does.
+WORDCLOUD_SOURCES = ["composer", "composition"]
+WORD_PATTERN = re.compile(r"\w[\w']*")
+
+# Aggregates precomputed at startup for the top 10 and frequency visualizations
+TOP_10_CATEGORIES = ["composer", "Key", "Instrumentation", "Piece Style"]
+FREQUENCY_PAIRS = [("Piece Style", "Instrumentation"), ("Piece Style", "composer"), ("Piece Style", "Key")]
+
+# Stacked bars show the top N values of each axis and fold the rest into "Other"; N is picked in the dashboard.
+# FREQUENCY_MAX_BARS caps the bar segments (x values times traces) of one figure whatever N is picked.
+FREQUENCY_TOP_N = 20
+FREQUENCY_TOP_N_OPTIONS = [10, 20, 50, 100]
+FREQUENCY_MAX_BARS = 2500
+
+# Rendered visualizations kept in memory; set FIGURE_CACHE_DIR to also keep them on disk across restarts
+FIGURE_CACHE_SIZE = 32
+FIGURE_CACHE_DIR = None
+
+# Composition explorer: rows per page and the filter dropdowns with the category each one filters on
+EXPLORER_PAGE_SIZE = 25
+EXPLORER_FILTERS = {"explorer-key": "Key", "explorer-style": "Piece Style", "explorer-instrumentation": "Instrumentation"}
+
+# Processes that render word clouds and figures off the request threads; 0 renders in the request thread
+RENDER_PROCESSES = 2
+
+# Word clouds and frequency charts render in Dash background jobs, so the page shows their progress and a render is
+# cancelled when the dropdowns change. Jobs and their results live in a diskcache in BACKGROUND_CACHE_DIR, which all
+# server processes share; None renders them in the request instead.
+BACKGROUND_CACHE_DIR = "cache/background"
+BACKGROUND_CACHE_SIZE = 2 ** 28
+# How long, in seconds, a background render stays shared; keys include the database version, so stale entries are never read
+BACKGROUND_RESULT_SECONDS = 24 * 60 * 60
+# How often, in seconds, a job waiting for an identical render started by another request checks for its result
+BACKGROUND_WAIT_SECONDS = 0.25
+
+# Visualizations pre-rendered by build_artifacts.py; set ARTIFACTS_DIR (or pass --static) to serve only these.
+# Each build is a directory named after the database version; CURRENT names the one being served.
+ARTIFACTS_DIR = None
+ARTIFACTS_URL = "/artifacts"
+ARTIFACTS_POINTER = "CURRENT"
+ARTIFACTS_MANIFEST = "manifest.json"
+
+# Prometheus metrics of the serving process
+METRICS_URL = "/metrics"
+
+# Callbacks run under cProfile, e.g. {"update_visualization"}; each call writes a .prof file to PROFILE_DIR
+PROFILE_CALLBACKS = set()
+PROFILE_DIR = "profiles"
+
+# How often, in seconds, requests check whether the database changed and a fresh snapshot should be loaded
+RELOAD_CHECK_SECONDS = 30
+
+# Dropdown choices; the explorer is added when the database is served
+VISUALIZATION_OPTIONS = [
+    {'label': 'Composer Names Word Cloud', 'value': 'composer_names_wordcloud'},
+    {'label': 'Composition Names Word Cloud', 'value': 'composition_names_wordcloud'},
+    {'label': 'Top 10 Categories', 'value': 'top_10'},
+    {'label': 'Instrumentations In Styles', 'value': 'frequency_Piece Style_Instrumentation'},
+    {'label': 'Authors In Styles', 'value': 'frequency_Piece Style_composer'},
+    {'label': 'Keys In Styles', 'value': 'frequency_Piece Style_Key'},
+]
+
+RENDER_PROGRESS_STYLE = {'text-align': 'center', 'color': 'gray', 'margin': '10px', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}
+
+# Namedtuples
+FrequencyTable = namedtuple("FrequencyTable", ["x_values", "y_values", "counts"])
+Snapshot = namedtuple("Snapshot", ["version", "word_frequencies", "top_10_data", "frequency_data", "filter_options"])
+
+# Metrics
+stage_seconds = metrics.histogram("harmony_stage_seconds", "Time spent loading data and rendering, per stage.", ["stage"])
+callback_seconds = metrics.histogram("harmony_callback_seconds", "Time spent per Dash callback.", ["callback"])
+callback_errors_total = metrics.counter("harmony_callback_errors_total", "Dash callbacks that raised, per callback.", ["callback"])
+callbacks_in_flight = metrics.gauge("harmony_callbacks_in_flight", "Dash callbacks currently running, per callback.", ["callback"])
+renders_in_flight = metrics.gauge("harmony_renders_in_flight", "Visualizations currently being rendered.")
+figure_cache_total = metrics.counter("harmony_figure_cache_total", "Figure cache lookups, by where the visualization came from.", ["result"])
+background_renders_total = metrics.counter("harmony_background_renders_total", "Renders handed to a background job.")
+snapshot_loads_total = metrics.counter("harmony_snapshot_loads_total", "Data snapshots loaded from the database.")
+
+# Figure cache
+class FigureCache:
+    def __init__(self, version, max_entries=FIGURE_CACHE_SIZE, cache_dir=FIGURE_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.set_version(version)
+
+    def set_version(self, version):
+        # Entries rendered from an older database are dropped, in memory and on disk
+        with self.lock:
+            self.version = version
+            self.entries.clear()
+        if self.cache_dir and version:
+            os.makedirs(self.version_dir(), exist_ok=True)
+            for entry in os.listdir(self.cache_dir):
+                if entry != version:
+                    shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+
+    def version_dir(self):
+        return os.path.join(self.cache_dir, self.version)
+
+    def disk_path(self, key):
+        return os.path.join(self.version_dir(), hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pkl")
+
+    def get_or_render(self, key, render):
+        visualization = self.get(key)
+        if visualization is None:
+            figure_cache_total.inc(result="render")
+            visualization = render()
+            self.put(key, visualization)
+        return visualization
+
+    def get(self, key):
+        # None when the visualization is neither in memory nor on disk
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                figure_cache_total.inc(result="memory")
+                return self.entries[key]
+
+        visualization = self.load(key)
+        if visualization is not None:
+            figure_cache_total.inc(result="disk")
+            self.remember(key, visualization)
+        return visualization
+
+    def put(self, key, visualization):
+        self.save(key, visualization)
+        self.remember(key, visualization)
+
+    def remember(self, key, visualization):
+        with self.lock:
+            self.entries[key] = visualization
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.disk_path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def save(self, key, visualization):
+        if not self.cache_dir:
+            return
+        # Written to a temporary file first so other workers never read a half-written entry
+        path = self.disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(visualization, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+def get_db_version():
+    # Changes whenever the scraper commits new data. Stamped from the data, not the files: any reader creates the
+    # -wal file, which would look like a write. Older databases without the counter fall back to the file's own stamp.
+    stamp = ""
+    if os.path.exists(DB_FILE_PATH):
+        with closing(queries.connect(DB_FILE_PATH)) as conn:
+            data_version = queries.fetch_data_version(conn)
+        if data_version is not None:
+            stamp = f"{data_version[0]}:{data_version[1]}"
+        else:
+            stat = os.stat(DB_FILE_PATH)
+            stamp = f"{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(stamp.encode("utf-8")).hexdigest()[:16]
+
+def fetch_data(conn):
+    # Word clouds only need one count per distinct word, so their cost follows the vocabulary, not the catalogue
+    try:
+        word_counts = {source: queries.fetch_word_counts(conn, source) for source in WORDCLOUD_SOURCES}
+    except sqlite3.OperationalError:
+        word_counts = {"composer": count_words(queries.fetch_composer_names(conn)),
+                       "composition": count_words(queries.fetch_work_titles(conn))}
+
+    return {source: build_word_frequencies(counts) for source, counts in word_counts.items()}
+
+def count_words(texts):
+    counts = Counter()
+    for text in texts:
+        counts.update(WORD_PATTERN.findall(text or ""))
+    return list(counts.items())
+
+def build_word_frequencies(word_counts):
+    # What WordCloud.process_text does after splitting the text, done on (word, count) pairs in order of first appearance:
+    # drop "'s", numbers and stopwords, then fold plurals and case variants into the most common spelling
+    stopwords = {word.lower() for word in STOPWORDS}
+    cases = defaultdict(dict)
+    for word, count in word_counts:
+        if word.lower().endswith("'s"):
+            word = word[:-2]
+        if word.isdigit() or word.lower() in stopwords:
+            continue
+        case_counts = cases[word.lower()]
+        case_counts[word] = case_counts.get(word, 0) + count
+
+    for key in list(cases):
+        if key.endswith('s') and not key.endswith('ss') and key[:-1] in cases:
+            singular_counts = cases[key[:-1]]
+            for word, count in cases.pop(key).items():
+                singular_counts[word[:-1]] = singular_counts.get(word[:-1], 0) + count
+
+    return {max(case_counts.items(), key=itemgetter(1))[0]: sum(case_counts.values()) for case_counts in cases.values()}
+
+def build_top_10(conn, category):
+    return queries.count_by(conn, category, limit=10)
+
+def build_frequency_table(conn, x_key, y_key):
+    pairs = queries.count_pairs(conn, x_key, y_key)
+
+    # x values keep their order of first appearance, y values are sorted by name
+    x_values = list(dict.fromkeys(x_val for x_val, y_val, count in pairs))
+    y_values = sorted(set(y_val for x_val, y_val, count in pairs))
+    x_positions = {x_val: i for i, x_val in enumerate(x_values)}
+    y_positions = {y_val: i for i, y_val in enumerate(y_values)}
+
+    counts = np.zeros((len(y_values), len(x_values)), dtype=np.int64)
+    for x_val, y_val, count in pairs:
+        counts[y_positions[y_val], x_positions[x_val]] = count
+
+    return FrequencyTable(x_values=x_values, y_values=y_values, counts=counts)
+
+def fold_frequency_table(table, top_n, max_bars=FREQUENCY_MAX_BARS):
+    # Keeps the top_n x values, then as many of the top y values as the bar budget allows
+    x_values, counts_by_x = fold_values(table.x_values, table.counts.T, top_n)
+    y_limit = max(1, min(top_n, max_bars // len(x_values) - 1)) if x_values else top_n
+    y_values, counts = fold_values(table.y_values, counts_by_x.T, y_limit)
+    return FrequencyTable(x_values=x_values, y_values=y_values, counts=counts)
+
+def fold_values(values, counts, limit):
+    # Rows of `counts` belong to `values`; keeps the `limit` rows with the largest totals in their original order
+    # and sums the others into one "Other" row
+    if len(values) <= limit:
+        return values, counts
+    totals = counts.sum(axis=1)
+    keep = np.sort(np.argsort(-totals, kind='stable')[:limit])
+    kept_counts = counts[keep]
+    other_counts = counts.sum(axis=0) - kept_counts.sum(axis=0)
+    return [values[i] for i in keep] + [f'Other ({len(values) - limit} more)'], np.vstack([kept_counts, other_counts])
+
+def build_aggregates(conn):
+    # Computed once, so each dropdown change is a dictionary lookup instead of a query
+    top_10_data = {category: build_top_10(conn, category) for category in TOP_10_CATEGORIES}
+    frequency_data = {(x_key, y_key): build_frequency_table(conn, x_key, y_key) for x_key, y_key in FREQUENCY_PAIRS}
+
+    return top_10_data, frequency_data
+
+def build_filter_options(conn):
+    return {category: [{'label': name, 'value': value} for value, name in queries.fetch_options(conn, category)] for category in EXPLORER_FILTERS.values()}
+
+def create_dash_app(artifacts_dir=ARTIFACTS_DIR):
+    global artifact_store, background_cache
+    # Static mode serves what build_artifacts.py rendered; the explorer needs the database, so it is left out
+    artifact_store = ArtifactStore(artifacts_dir) if artifacts_dir else None
+
+    visualization_options = list(VISUALIZATION_OPTIONS)
+    if artifact_store is None:
+        visualization_options.append({'label': 'Composition Explorer', 'value': 'explorer'})
+
+    # Static mode has nothing to render, so it runs no background jobs
+    background_cache = None
+    if artifact_store is None and BACKGROUND_CACHE_DIR:
+        background_cache = diskcache.Cache(BACKGROUND_CACHE_DIR, size_limit=BACKGROUND_CACHE_SIZE)
+        # The slow renders run in the job processes, and a top 10 chart is cheaper to draw than to send to a render
+        # process, so no render processes are started
+        render_pool.processes = 0
+
     # Create Dash App
-    app = Dash(__name__)
+    app = Dash(__name__, background_callback_manager=DiskcacheManager(background_cache) if background_cache is not None else None)
 
     app.layout = html.Div([
+        html.Div([
+            dcc.Dropdown(
+                id='visualization-dropdown',
+                options=visualization_options,
+                value='composer_names_wordcloud',
+                clearable=False
+            ), 
+            html.Div(id="visualization-container"),
+        ], style={'width': '50%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
+        
+        html.Div([
+            dcc.Dropdown(
+                id='sub-dropdown',
+                options=[
+                    {'label': 'Most Productive Composers', 'value': 'composer'},
+                    {'label': 'Most Popular Keys', 'value': 'Key'},
+                    {'label': 'Most Popular Instrumentation', 'value': 'Instrumentation'},
+                    {'label': 'Most Popular Styles', 'value': 'Piece Style'},
+                ],
+                multi=False,
+                value='composer',
+                style={'display' : 'none'},
+                clearable=False
+            ), 
+            html.Div(id="sub-dropdown-container"),
+        ], style={'width': '50%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
+
+        html.Div([
+            dcc.Dropdown(
+                id='top-n-dropdown',
+                options=[{'label': f'Top {top_n} Of Each Axis', 'value': top_n} for top_n in FREQUENCY_TOP_N_OPTIONS],
+                value=FREQUENCY_TOP_N,
+                style={'display': 'none'},
+                clearable=False
+            ),
+        ], style={'width': '50%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
+
+        # Shown while a background job renders, with what it is doing
+        html.Div(id='render-progress', style={**RENDER_PROGRESS_STYLE, 'display': 'none'}),
+        dcc.Store(id='render-request'),
+
+        # Only the visualization is covered while it loads, so the dropdowns can still change (and cancel) a render
         dcc.Loading(
             id="loading-container",
             type="dot",
-            fullscreen=True,
             color="lightsteelblue",
-            children=[
-                html.Div([
-                    dcc.Dropdown(
-                        id='visualization-dropdown',
-                        options=[
-                            {'label': 'Composer Names Word Cloud', 'value': 'composer_names_wordcloud'},
-                            {'label': 'Composition Names Word Cloud', 'value': 'composition_names_wordcloud'},
-                            {'label': 'Top 10 Categories', 'value': 'top_10'},
-                            {'label': 'Instrumentations In Styles', 'value': 'frequency_Piece Style_Instrumentation'},
-                            {'label': 'Authors In Styles', 'value': 'frequency_Piece Style_composer'},
-                            {'label': 'Keys In Styles', 'value': 'frequency_Piece Style_Key'}
-                        ],
-                        value='composer_names_wordcloud',
-                        clearable=False
-                    ), 
-                    html.Div(id="visualization-container"),
-                ], style={'width': '50%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
-                
-                html.Div([
-                    dcc.Dropdown(
-                        id='sub-dropdown',
-                        options=[
-                            {'label': 'Most Productive Composers', 'value': 'composer'},
-                            {'label': 'Most Popular Keys', 'value': 'Key'},
-                            {'label': 'Most Popular Instrumentation', 'value': 'Instrumentation'},
-                            {'label': 'Most Popular Styles', 'value': 'Piece Style'},
-                        ],
-                        multi=False,
-                        value='composer',
-                        style={'display' : 'none'},
-                        clearable=False
-                    ), 
-                    html.Div(id="sub-dropdown-container"),
-                ], style={'width': '50%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
-
-                html.Div(id='visualization-output', style={'text-align': 'center'}),
-            ],
+            children=[html.Div(id='visualization-output', style={'text-align': 'center'})],
         ),
+
+        # Kept outside the loading container so typing a search does not cover the page
+        html.Div([
+            dcc.Input(id='explorer-search', type='search', placeholder='Search titles and composers', debounce=False,
+                      style={'width': '100%', 'padding': '6px', 'box-sizing': 'border-box'}),
+            html.Div([
+                dcc.Dropdown(id=filter_id, placeholder=category, style={'flex': '1'})
+                for filter_id, category in EXPLORER_FILTERS.items()
+            ], style={'display': 'flex', 'gap': '10px', 'margin': '10px 0'}),
+            html.Table(id='explorer-results', style={'width': '100%', 'border-collapse': 'collapse'}),
+            html.Div([
+                html.Button('Previous', id='explorer-previous', disabled=True),
+                html.Span(id='explorer-page', style={'margin': '0 10px'}),
+                html.Button('Next', id='explorer-next', disabled=True),
+            ], style={'text-align': 'center', 'margin': '10px'}),
+            dcc.Store(id='explorer-cursor'),
+        ], id='explorer-container', style={'display': 'none', 'width': '80%', 'margin': '10px auto', 'color': '#333', 'font-family': '"Open Sans", verdana, arial, sans-serif', 'font-size': '12px'}),
     ])
 
+    if artifact_store is not None:
+        # Artifact directories never change once built, so browsers may keep their files. The version is joined into
+        # the file name, not the directory, so send_from_directory refuses any path that leaves the artifacts directory
+        @app.server.route(f'{ARTIFACTS_URL}/<version>/<path:filename>')
+        def serve_artifact(version, filename):
+            return send_from_directory(artifact_store.artifacts_dir, f"{version}/{filename}", max_age=365 * 24 * 3600)
+
+    @app.server.route(METRICS_URL)
+    def serve_metrics():
+        merge_background_metrics()
+        return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+    register_callbacks(app)
+
     return app
 
-# Create the Dash App
-app = create_dash_app()
+def load_snapshot():
+    # The version is read before the data, so a write that lands while loading triggers another reload
+    version = get_db_version()
+    with closing(queries.connect(DB_FILE_PATH)) as conn:
+        with stage_seconds.time(stage="fetch_data"):
+            word_frequencies = fetch_data(conn)
+        with stage_seconds.time(stage="build_aggregates"):
+            top_10_data, frequency_data = build_aggregates(conn)
+        with stage_seconds.time(stage="build_filter_options"):
+            filter_options = build_filter_options(conn)
+    snapshot_loads_total.inc()
+    return Snapshot(version=version, word_frequencies=word_frequencies, top_10_data=top_10_data, frequency_data=frequency_data, filter_options=filter_options)
+
+# Data snapshots
+class SnapshotStore:
+    def __init__(self, check_seconds=RELOAD_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self.snapshot = None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.reloading = False
+        self.last_check = time.monotonic()
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            # First request: wait for the data, or for a background load that is already running
+            with self.load_lock:
+                if self.snapshot is None:
+                    self.swap(load_snapshot())
+            return self.snapshot
+
+        if time.monotonic() - self.last_check >= self.check_seconds:
+            self.last_check = time.monotonic()
+            if get_db_version() != snapshot.version:
+                self.reload_in_background()
 
-# Fetch and extract data
-composers_data, compositions_data = fetch_data()
-composers, compositions, composer_names, composition_names = extract_data(composers_data, compositions_data)
+        return snapshot
 
-# Wordcloud face mask
-face_mask = np.array(Image.open(FACE_IMG_PATH))
-# Wordcloud music mask
-music_mask = np.array(Image.open(MUSIC_IMG_PATH))
+    def reload_in_background(self):
+        with self.lock:
+            if self.reloading:
+                return
+            self.reloading = True
+        threading.Thread(target=self.reload, daemon=True).start()
 
-def generate_wordcloud(title, category):
-    data = composer_names if category == "composer" else composition_names
-    mask = face_mask if category == 'composer' else music_mask
-    wordcloud = WordCloud(width=800, height=400, background_color='white', colormap='twilight', mask=mask, collocations=False).generate(' '.join(data))
+    def reload(self):
+        try:
+            with self.load_lock:
+                self.swap(load_snapshot())
+        except Exception as e:
+            print(f"Error reloading data: {e}")
+        finally:
+            with self.lock:
+                self.reloading = False
+
+    def swap(self, snapshot):
+        # Replacing the reference is atomic; callbacks that already hold the old snapshot finish with it
+        self.snapshot = snapshot
+        figure_cache.set_version(snapshot.version)
+
+# Render processes
+class RenderPool:
+    def __init__(self, processes=RENDER_PROCESSES):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def get_executor(self):
+        # Started on first use in each server process; a pool inherited through fork would belong to the parent.
+        # Spawned processes start clean instead of copying the server's threads and open connections.
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"), initializer=prepare_renderer)
+                self.pid = os.getpid()
+            return self.executor
+
+    def start(self):
+        # Starts the processes up front, so the first render doesn't wait for them to import the plotting libraries
+        if self.processes > 0:
+            executor = self.get_executor()
+            for future in [executor.submit(os.getpid) for _ in range(self.processes)]:
+                future.result()
+
+    def render(self, function, *args):
+        # The request thread only waits on the result, so the GIL stays free for other requests meanwhile
+        if self.processes <= 0:
+            return function(*args)
+        try:
+            return self.get_executor().submit(function, *args).result()
+        except BrokenProcessPool:
+            with self.lock:
+                self.executor = None
+            print("Render process died; rendering in the request thread.")
+            return function(*args)
+
+# Pre-rendered artifacts
+class ArtifactStore:
+    def __init__(self, artifacts_dir, check_seconds=RELOAD_CHECK_SECONDS):
+        self.artifacts_dir = os.path.abspath(artifacts_dir)
+        self.check_seconds = check_seconds
+        self.manifest = None
+        self.last_check = None
+
+    def get_manifest(self):
+        # A new build is picked up once build_artifacts.py points CURRENT at it
+        if self.last_check is None or time.monotonic() - self.last_check >= self.check_seconds:
+            self.last_check = time.monotonic()
+            version = read_artifacts_version(self.artifacts_dir)
+            if version is not None and (self.manifest is None or self.manifest['version'] != version):
+                try:
+                    with open(os.path.join(self.artifacts_dir, version, ARTIFACTS_MANIFEST), encoding='utf-8') as f:
+                        self.manifest = json.load(f)
+                    figure_cache.set_version(version)
+                except (OSError, ValueError) as e:
+                    print(f"Error loading artifacts {version}: {e}")
+        return self.manifest
+
+    def load(self, key):
+        manifest = self.get_manifest()
+        if manifest is None or key not in manifest['artifacts']:
+            return html.Div('This visualization has not been built; run "python build_artifacts.py".')
+        return figure_cache.get_or_render(f"{manifest['version']}_{key}", lambda: self.load_artifact(manifest['version'], manifest['artifacts'][key]))
+
+    def load_artifact(self, version, artifact):
+        # Word clouds are fetched by the browser straight from the artifact directory; figures are sent as they were built
+        if artifact['kind'] == 'wordcloud':
+            return wordcloud_image(f"{ARTIFACTS_URL}/{version}/{artifact['file']}", artifact['title'])
+        with stage_seconds.time(stage="load_artifact"), open(os.path.join(self.artifacts_dir, version, artifact['file']), encoding='utf-8') as f:
+            figure = json.load(f)
+        return top_10_graph(figure) if artifact['kind'] == 'top_10' else frequency_graph(figure)
+
+def read_artifacts_version(artifacts_dir):
+    try:
+        with open(os.path.join(artifacts_dir, ARTIFACTS_POINTER), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def visualization_key(option, sub_option, top_n=FREQUENCY_TOP_N):
+    # Names one dropdown choice; also the name of its artifact
+    if option == 'top_10':
+        return f'{option}_{sub_option}'
+    if option.startswith('frequency'):
+        return f'{option}_top_{top_n}'
+    return option
+
+# Data is loaded on the first request or by a background preload, and reloaded when the database changes.
+# In static mode the artifact store takes its place and the database is never opened.
+figure_cache = FigureCache(None)
+data_store = SnapshotStore()
+render_pool = RenderPool()
+artifact_store = None
+background_cache = None
+explorer_connections = threading.local()
+
+@lru_cache(maxsize=None)
+def load_mask(path):
+    return np.array(Image.open(path))
+
+def prepare_renderer():
+    # Runs once in each render process
+    load_mask(FACE_IMG_PATH)
+    load_mask(MUSIC_IMG_PATH)
+
+def generate_wordcloud(data, title, category):
+    frequencies = data.word_frequencies['composer' if category == 'composer' else 'composition']
+    with stage_seconds.time(stage="generate_wordcloud"), renders_in_flight.track():
+        return render_pool.render(render_wordcloud, frequencies, title, FACE_IMG_PATH if category == 'composer' else MUSIC_IMG_PATH)
+
+def render_wordcloud(frequencies, title, mask_path):
+    encoded_image = base64.b64encode(draw_wordcloud(frequencies, mask_path)).decode('utf-8')
+    return wordcloud_image(f'data:image/png;base64,{encoded_image}', title)
+
+def draw_wordcloud(frequencies, mask_path):
+    # Returns the word cloud as PNG bytes
+    mask = load_mask(mask_path)
+    wordcloud = WordCloud(width=800, height=400, background_color='white', colormap='twilight', mask=mask, collocations=False).generate_from_frequencies(frequencies)
     image_stream = BytesIO()
     wordcloud.to_image().save(image_stream, format='PNG')
-    encoded_image = base64.b64encode(image_stream.getvalue()).decode('utf-8')
-    return html.Img(src=f'data:image/png;base64,{encoded_image}', alt=title, style={'max-width': '100%', 'margin': '20px auto', 'border-radius': '10px'})
+    return image_stream.getvalue()
 
-def generate_top_10(category):
-    category_data = [entry[category] for entry in compositions]
-    top_data = Counter(category_data).most_common(10)
+def wordcloud_image(src, title):
+    return html.Img(src=src, alt=title, style={'max-width': '100%', 'margin': '20px auto', 'border-radius': '10px'})
+
+def generate_top_10(data, category):
+    if category in data.top_10_data:
+        top_data = data.top_10_data[category]
+    else:
+        with closing(queries.connect(DB_FILE_PATH)) as conn:
+            top_data = build_top_10(conn, category)
+    with stage_seconds.time(stage="generate_top_10"), renders_in_flight.track():
+        return render_pool.render(render_top_10, top_data, category)
+
+def render_top_10(top_data, category):
+    return top_10_graph(top_10_figure(top_data, category))
+
+def top_10_figure(top_data, category):
     category_string = category.capitalize()
 
     fig = px.scatter(x=[item[0] for item in top_data], y=[item[1] for item in top_data],
@@ -151,29 +619,30 @@ def generate_top_10(category):
         )
     )
 
-    return dcc.Graph(figure=fig, style={'width': '80%', 'margin': '20px auto', 'border-radius': '10px', 'color': '#333'})
-
-def generate_frequency(x_key, y_key):
-    counts_per_x = defaultdict(Counter)
+    return fig
 
-    for entry in compositions:
-        x_val = entry[x_key]
-        y_val = entry[y_key]
+def top_10_graph(figure):
+    return dcc.Graph(figure=figure, style={'width': '80%', 'margin': '20px auto', 'border-radius': '10px', 'color': '#333'})
 
-        if x_val and y_val:
-            counts_per_x[x_val][y_val] += 1
+def generate_frequency(data, x_key, y_key, top_n=FREQUENCY_TOP_N):
+    if (x_key, y_key) in data.frequency_data:
+        table = data.frequency_data[(x_key, y_key)]
+    else:
+        with closing(queries.connect(DB_FILE_PATH)) as conn:
+            table = build_frequency_table(conn, x_key, y_key)
+    # Folded before rendering, so only the bounded table is sent to the render process
+    with stage_seconds.time(stage="generate_frequency"), renders_in_flight.track():
+        return render_pool.render(render_frequency, fold_frequency_table(table, top_n), x_key, y_key)
 
-    non_empty_x_values = [x_val for x_val, counts in counts_per_x.items() if any(counts.values())]
-    non_empty_y_values = set(y_val for counts in counts_per_x.values() for y_val, count in counts.items() if count > 0)
+def render_frequency(table, x_key, y_key):
+    return frequency_graph(frequency_figure(table, x_key, y_key))
 
+def frequency_figure(table, x_key, y_key):
     fig = go.Figure()
 
-    for i, y_val in enumerate(non_empty_y_values):
-        y_counts = [counts[y_val] for x_val, counts in counts_per_x.items() if x_val in non_empty_x_values]
-
-        if any(y_counts):
-            gradient_color = f'hsl({i * (360 / len(non_empty_y_values))}, 50%, 50%)'
-            fig.add_trace(go.Bar(x=non_empty_x_values, y=y_counts, name=str(y_val), marker_color=gradient_color))
+    for i, y_val in enumerate(table.y_values):
+        gradient_color = f'hsl({i * (360 / len(table.y_values))}, 50%, 50%)'
+        fig.add_trace(go.Bar(x=table.x_values, y=table.counts[i], name=str(y_val), marker_color=gradient_color))
 
     fig.update_layout(
         barmode="stack",
@@ -192,29 +661,278 @@ def generate_frequency(x_key, y_key):
         template="seaborn"
     )
 
-    return dcc.Graph(figure=fig, style={'width': '90%', 'margin': '10px auto', 'border-radius': '10px', 'color': '#333'})
+    return fig
+
+def frequency_graph(figure):
+    return dcc.Graph(figure=figure, style={'width': '90%', 'margin': '10px auto', 'border-radius': '10px', 'color': '#333'})
+
+def get_explorer_connection():
+    # Each server thread keeps its own connection, so a keystroke costs a query instead of opening the database
+    conn = getattr(explorer_connections, "conn", None)
+    if conn is None:
+        conn = explorer_connections.conn = queries.connect(DB_FILE_PATH)
+    return conn
+
+def generate_explorer_table(rows):
+    cell_style = {'padding': '4px 8px', 'border-bottom': '1px solid #eee', 'text-align': 'left'}
+    header = html.Tr([html.Th(column, style=cell_style) for column in ['Title', 'Composer', 'Key', 'Style', 'Instrumentation']])
+    body = [html.Tr([html.Td(value or '', style=cell_style) for value in (work_title or full_name, composer, key, style, instrumentation)])
+            for composition_id, work_title, full_name, composer, key, style, instrumentation in rows]
+    return [html.Thead(header), html.Tbody(body)]
 
 # Callback to update the visualization based on dropdown selection
-@app.callback(
-    [Output('visualization-output', 'children'),
-     Output('sub-dropdown', 'style')],
-    [Input('visualization-dropdown', 'value'),
-     Input('sub-dropdown', 'value')]
-)
-def update_visualization(selected_option, selected_sub_option):
+def update_visualization(selected_option, selected_sub_option, top_n, explorer_style):
+    sub_style = {'display': ''} if selected_option == 'top_10' else {'display': 'none'}
+    top_n_style = {'display': ''} if selected_option.startswith('frequency') else {'display': 'none'}
+    explorer_style = {**explorer_style, 'display': 'block' if selected_option == 'explorer' else 'none'}
+    # Only the offered sizes are rendered, whatever the request asks for
+    top_n = top_n if top_n in FREQUENCY_TOP_N_OPTIONS else FREQUENCY_TOP_N
+
+    if artifact_store is not None:
+        return artifact_store.load(visualization_key(selected_option, selected_sub_option, top_n)), sub_style, top_n_style, explorer_style, no_update
+
+    # One snapshot per callback, so a reload in the middle of a render cannot mix old and new data
+    data = data_store.get()
+    job = visualization_job(data, selected_option, selected_sub_option, top_n)
+    if job is None:
+        return None, sub_style, top_n_style, explorer_style, no_update
+    key, render = job
+
+    if not renders_in_background(selected_option):
+        return figure_cache.get_or_render(key, render), sub_style, top_n_style, explorer_style, no_update
+
+    visualization = cached_visualization(key)
+    if visualization is not None:
+        return visualization, sub_style, top_n_style, explorer_style, no_update
+    # Each request gets its own id: Dash keeps a job's result under a hash of its arguments and deletes it once read,
+    # so two identical requests would otherwise share, and lose, one result
+    background_renders_total.inc()
+    request = {'option': selected_option, 'sub_option': selected_sub_option, 'top_n': top_n, 'id': uuid.uuid4().hex}
+    return None, sub_style, top_n_style, explorer_style, request
+
+def visualization_job(data, selected_option, selected_sub_option, top_n):
+    # The figure cache key and render function of a dropdown choice, or None when there is nothing to render
     if selected_option == 'composer_names_wordcloud':
-        return generate_wordcloud('Composer Names Word Cloud', 'composer'), {'display': 'none'}
+        return f'{data.version}_{selected_option}', lambda: generate_wordcloud(data, 'Composer Names Word Cloud', 'composer')
     elif selected_option == 'composition_names_wordcloud':
-        return generate_wordcloud('Piece Titles Word Cloud', 'composition'), {'display': 'none'}
+        return f'{data.version}_{selected_option}', lambda: generate_wordcloud(data, 'Piece Titles Word Cloud', 'composition')
     elif selected_option == 'top_10':
-        return generate_top_10(selected_sub_option), {'display': ''}
+        return f'{data.version}_{selected_option}_{selected_sub_option}', lambda: generate_top_10(data, selected_sub_option)
     elif selected_option.startswith('frequency'):
         option_parts = selected_option.split('_')
         type_value, x_key, y_key = option_parts
-        return generate_frequency(x_key, y_key), {'display': 'none'}
-    else:
-        return None, {'display': 'none'}
+        return f'{data.version}_{selected_option}_top_{top_n}', lambda: generate_frequency(data, x_key, y_key, top_n)
+    return None
+
+def renders_in_background(selected_option):
+    # Word clouds and frequency charts take seconds; top 10 charts are quick enough to render in the request
+    return background_cache is not None and (selected_option.endswith('wordcloud') or selected_option.startswith('frequency'))
+
+def cached_visualization(key):
+    # Rendered before by this process, or by a background job of any server process
+    visualization = figure_cache.get(key)
+    if visualization is None:
+        visualization = background_cache.get(f'figure_{key}')
+        if visualization is not None:
+            figure_cache_total.inc(result="background")
+            figure_cache.put(key, visualization)
+    return visualization
+
+# Background callback that renders a word cloud or frequency chart requested by update_visualization
+def render_visualization(set_progress, request):
+    # Runs in a job process forked from the server, which is already off the request threads
+    data = data_store.get()
+    key, render = visualization_job(data, request['option'], request['sub_option'], request['top_n'])
+    label = next(option['label'] for option in VISUALIZATION_OPTIONS if option['value'] == request['option'])
+    return coalesced_render(key, render, lambda status: set_progress(f'{status} {label}...'))
+
+def coalesced_render(key, render, report):
+    # Identical requests share one render: the first job to claim the key renders it, the others wait for its result.
+    # A cancelled job is killed without releasing its claim, so a claim whose process is gone is taken over.
+    result_key, claim_key = f'figure_{key}', f'rendering_{key}'
+    waiting = False
+    while True:
+        visualization = background_cache.get(result_key)
+        if visualization is not None:
+            return visualization
+
+        if background_cache.add(claim_key, os.getpid()):
+            try:
+                # The previous owner may have stored its result and released the claim since the lookup above
+                visualization = background_cache.get(result_key)
+                if visualization is not None:
+                    return visualization
+                report('Rendering')
+                visualization = figure_cache.get_or_render(key, render)
+                background_cache.set(result_key, visualization, expire=BACKGROUND_RESULT_SECONDS)
+                return visualization
+            finally:
+                background_cache.delete(claim_key)
+
+        with background_cache.transact():
+            owner = background_cache.get(claim_key)
+            if owner is not None and not process_alive(owner):
+                background_cache.delete(claim_key)
+                continue
+
+        if not waiting:
+            waiting = True
+            report('Another request is already rendering')
+        time.sleep(BACKGROUND_WAIT_SECONDS)
+
+def process_alive(pid):
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+# Callback to fill the explorer filters once the explorer is opened
+def update_explorer_filters(selected_option):
+    if selected_option != 'explorer':
+        return [no_update] * len(EXPLORER_FILTERS)
+    data = data_store.get()
+    return [data.filter_options[category] for category in EXPLORER_FILTERS.values()]
+
+# Callback to search and page through compositions; each request reads only the rows of the page it shows
+def update_explorer(search_text, *args):
+    filters = dict(zip(EXPLORER_FILTERS.values(), args[:len(EXPLORER_FILTERS)]))
+    cursor = args[-1] or {'page': 1, 'first_id': None, 'last_id': None}
+
+    # Next and Previous continue from the ids at the edges of the current page; any other change starts over
+    after_id = before_id = None
+    page = 1
+    if ctx.triggered_id == 'explorer-next' and cursor['last_id'] is not None:
+        after_id, page = cursor['last_id'], cursor['page'] + 1
+    elif ctx.triggered_id == 'explorer-previous' and cursor['first_id'] is not None:
+        before_id, page = cursor['first_id'], cursor['page'] - 1
+
+    try:
+        rows, has_more = queries.search_compositions(get_explorer_connection(), search_text, filters, after_id=after_id, before_id=before_id, limit=EXPLORER_PAGE_SIZE)
+    except sqlite3.OperationalError as e:
+        print(f"Error searching compositions: {e}")
+        return html.Caption('Search is unavailable; run "python scraper.py --migrate" to build the search index.'), None, True, True, ''
+
+    has_previous = has_more if before_id is not None else after_id is not None
+    has_next = has_more if before_id is None else True
+    cursor = {'page': page, 'first_id': rows[0][0] if rows else None, 'last_id': rows[-1][0] if rows else None}
+
+    if not rows:
+        return html.Caption('No compositions found.'), cursor, not has_previous, True, ''
+    return generate_explorer_table(rows), cursor, not has_previous, not has_next, f'Page {page}'
+
+def instrument(name, callback):
+    # Times every call of a callback, counts the ones in flight and the ones that raise
+    @wraps(callback)
+    def instrumented(*args):
+        with callbacks_in_flight.track(callback=name), callback_seconds.time(callback=name):
+            try:
+                if name in PROFILE_CALLBACKS:
+                    return profile_call(name, callback, *args)
+                return callback(*args)
+            except Exception:
+                callback_errors_total.inc(callback=name)
+                raise
+    return instrumented
+
+def forward_metrics(callback):
+    # Background jobs run in a forked process whose metrics would be lost when it exits. What a job counts and
+    # observes is queued in the background cache and merged by the next server process that serves /metrics.
+    @wraps(callback)
+    def forwarded(*args):
+        before = metrics.collect()
+        try:
+            return callback(*args)
+        finally:
+            changes = metrics.changes_since(before)
+            if changes:
+                background_cache.push(changes, prefix='metrics', expire=BACKGROUND_RESULT_SECONDS)
+    return forwarded
+
+def merge_background_metrics():
+    if background_cache is None:
+        return
+    while True:
+        key, changes = background_cache.pull(prefix='metrics')
+        if key is None:
+            return
+        metrics.merge(changes)
+
+def profile_call(name, callback, *args):
+    # Load a profile with: python -m pstats profiles/<file>.prof
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(callback, *args)
+    finally:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}-{time.time_ns()}.prof"))
+
+def register_callbacks(app):
+    app.callback(
+        [Output('visualization-output', 'children'),
+         Output('sub-dropdown', 'style'),
+         Output('top-n-dropdown', 'style'),
+         Output('explorer-container', 'style'),
+         Output('render-request', 'data')],
+        [Input('visualization-dropdown', 'value'),
+         Input('sub-dropdown', 'value'),
+         Input('top-n-dropdown', 'value')],
+        [State('explorer-container', 'style')]
+    )(instrument('update_visualization', update_visualization))
+
+    if artifact_store is not None:
+        return
+
+    if background_cache is not None:
+        # A new request replaces a running job, and any dropdown change cancels it, so a stale render never lands
+        app.callback(
+            Output('visualization-output', 'children', allow_duplicate=True),
+            Input('render-request', 'data'),
+            background=True,
+            progress=[Output('render-progress', 'children')],
+            running=[(Output('render-progress', 'style'), {**RENDER_PROGRESS_STYLE, 'display': 'block'}, {**RENDER_PROGRESS_STYLE, 'display': 'none'})],
+            cancel=[Input('visualization-dropdown', 'value'),
+                    Input('sub-dropdown', 'value'),
+                    Input('top-n-dropdown', 'value')],
+            prevent_initial_call=True
+        )(forward_metrics(instrument('render_visualization', render_visualization)))
+
+    app.callback(
+        [Output(filter_id, 'options') for filter_id in EXPLORER_FILTERS],
+        [Input('visualization-dropdown', 'value')]
+    )(instrument('update_explorer_filters', update_explorer_filters))
+
+    app.callback(
+        [Output('explorer-results', 'children'),
+         Output('explorer-cursor', 'data'),
+         Output('explorer-previous', 'disabled'),
+         Output('explorer-next', 'disabled'),
+         Output('explorer-page', 'children')],
+        [Input('explorer-search', 'value')] +
+        [Input(filter_id, 'value') for filter_id in EXPLORER_FILTERS] +
+        [Input('explorer-previous', 'n_clicks'),
+         Input('explorer-next', 'n_clicks')],
+        [State('explorer-cursor', 'data')]
+    )(instrument('update_explorer', update_explorer))
+
+def create_server(preload=True, artifacts_dir=ARTIFACTS_DIR):
+    # WSGI app factory for production servers, see wsgi.py and gunicorn.conf.py
+    app = create_dash_app(artifacts_dir)
+    if preload and artifact_store is None:
+        # Loaded once in the server's master process; forked workers share the snapshot copy-on-write.
+        # Freezing moves it out of the garbage collector's reach, so collections in the workers don't write to (and copy) its pages.
+        data_store.get()
+        gc.freeze()
+    return app.server
 
 # Run the app
 if __name__ == "__main__":
-    app.run_server(debug=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Harmony dashboard.")
+    parser.add_argument("--static", metavar="DIR", default=ARTIFACTS_DIR, help="serve only the artifacts built by build_artifacts.py into DIR")
+    parser.add_argument("--profile", metavar="CALLBACK", action="append", default=[], help="write a cProfile file for every call of this callback")
+    args = parser.parse_args()
+    PROFILE_CALLBACKS.update(args.profile)
+
+    app = create_dash_app(args.static)
+    if artifact_store is None:
+        data_store.reload_in_background()
+    app.run_server(debug=False)
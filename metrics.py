@@ -0,0 +1,255 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import copy
+import threading
+import time
+
+# Constants
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket upper bounds in seconds, from a cached figure to a slow page fetch or word cloud
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Metrics
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = sorted(self.values.items())
+        if not values and not self.label_names and self.kind != "histogram":
+            values = [((), 0)]
+        for key, value in values:
+            lines.extend(self.render_value(key, value))
+        return lines
+
+    def render_value(self, key, value):
+        return [f"{self.name}{self.label_text(key)} {format_number(value)}"]
+
+    def copy(self):
+        with self.lock:
+            return copy.deepcopy(self.values)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def total(self):
+        # Summed over every label value
+        with self.lock:
+            return sum(self.values.values())
+
+    def changes(self, before):
+        with self.lock:
+            return {key: value - before.get(key, 0) for key, value in self.values.items() if value != before.get(key, 0)}
+
+    def merge(self, changes):
+        with self.lock:
+            for key, amount in changes.items():
+                self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels):
+        # Counts the block as in flight while it runs
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        # Only the value's own bucket is counted here; buckets are made cumulative when rendered
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts = self.values.get(self.key(labels))
+        return counts[2] if counts else 0
+
+    def sum(self, **labels):
+        counts = self.values.get(self.key(labels))
+        return counts[1] if counts else 0.0
+
+    def changes(self, before):
+        with self.lock:
+            changes = {}
+            for key, (bucket_counts, total, count) in self.values.items():
+                before_counts, before_total, before_count = before.get(key, [[0] * len(bucket_counts), 0.0, 0])
+                if count != before_count:
+                    changes[key] = [[a - b for a, b in zip(bucket_counts, before_counts)], total - before_total, count - before_count]
+            return changes
+
+    def merge(self, changes):
+        with self.lock:
+            for key, (bucket_counts, total, count) in changes.items():
+                counts = self.values.get(key)
+                if counts is None:
+                    counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                counts[0] = [a + b for a, b in zip(counts[0], bucket_counts)]
+                counts[1] += total
+                counts[2] += count
+
+    def render_value(self, key, value):
+        bucket_counts, total, count = value[0][:], value[1], value[2]
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{self.label_text(key, [('le', format_number(bound))])} {cumulative}")
+        lines.append(f"{self.name}_sum{self.label_text(key)} {format_number(total)}")
+        lines.append(f"{self.name}_count{self.label_text(key)} {count}")
+        return lines
+
+# Registry
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        # Registering a name twice returns the first metric, so a reloaded module keeps counting where it left off
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def collect(self):
+        # Counter and histogram values; gauges describe this process only, so they are never carried to another one
+        with self.lock:
+            metrics = [metric for metric in self.metrics.values() if isinstance(metric, (Counter, Histogram))]
+        return {metric.name: metric.copy() for metric in metrics}
+
+    def changes(self, before):
+        with self.lock:
+            metrics = [metric for metric in self.metrics.values() if metric.name in before]
+        changes = {metric.name: metric.changes(before[metric.name]) for metric in metrics}
+        return {name: values for name, values in changes.items() if values}
+
+    def merge(self, changes):
+        with self.lock:
+            metrics = [(self.metrics[name], values) for name, values in changes.items() if name in self.metrics]
+        for metric, values in metrics:
+            metric.merge(values)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def counter(name, help_text, label_names=()):
+    return registry.register(Counter(name, help_text, label_names))
+
+def gauge(name, help_text, label_names=()):
+    return registry.register(Gauge(name, help_text, label_names))
+
+def histogram(name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, help_text, label_names, buckets))
+
+def collect():
+    return registry.collect()
+
+def changes_since(before):
+    # What was counted and observed since collect() returned before, e.g. by a short-lived child process
+    return registry.changes(before)
+
+def merge(changes):
+    # Adds changes recorded by another process to this one's counters and histograms
+    registry.merge(changes)
+
+def render():
+    # Prometheus text exposition format
+    return registry.render()
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Standalone endpoint, for processes without a web server of their own
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, host="0.0.0.0"):
+    # Serves /metrics (and every other path) from a daemon thread until the process exits
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,142 @@
+import re
+import sqlite3
+
+# Dashboard category -> (foreign key column on Compositions, lookup table, name column)
+CATEGORIES = {
+    "composer": ("composer_id", "Composers", "full_name"),
+    "Key": ("key_id", "Keys", "name"),
+    "Instrumentation": ("instrumentation_id", "Instrumentations", "name"),
+    "Piece Style": ("piece_style_id", "Styles", "name"),
+    "Language": ("language_id", "Languages", "name"),
+}
+
+# Explorer filters and the terms they are indexed as in CompositionSearch.facets, e.g. key 3 -> "key3"
+FACET_TERMS = {
+    "Key": "key",
+    "Piece Style": "style",
+    "Instrumentation": "instrumentation",
+}
+
+# Shortest word that is searched as a prefix; CompositionSearch keeps prefix indexes for 2 and 3 characters
+MIN_PREFIX_LENGTH = 2
+
+def connect(db_file_path):
+    # The dashboard only ever reads
+    conn = sqlite3.connect(db_file_path, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+def fetch_data_version(conn):
+    # (database id, counter) that the scraper bumps with every commit that changes the data; None before schema version 6
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'DataVersion'").fetchone() is None:
+        return None
+    return conn.execute("SELECT database_id, version FROM DataVersion").fetchone()
+
+def fetch_composer_names(conn):
+    return [row[0] for row in conn.execute("SELECT full_name FROM Composers")]
+
+def fetch_work_titles(conn):
+    return [row[0] for row in conn.execute("SELECT COALESCE(work_title, '') FROM Compositions")]
+
+def fetch_word_counts(conn, source):
+    # (word, count) pairs in order of first appearance, kept up to date by the scraper
+    return conn.execute("SELECT word, count FROM WordCounts WHERE source = ? AND count > 0 ORDER BY id", (source,)).fetchall()
+
+def count_by(conn, category, limit=None):
+    # GROUP BY runs on the foreign key index; only one row per distinct value comes back.
+    # Missing values count as "", and ties keep the order in which values first appear.
+    foreign_key, table, name_column = CATEGORIES[category]
+    rows = conn.execute(f'''SELECT COALESCE(lookup.{name_column}, ''), counts.total, counts.first_id
+                            FROM (SELECT {foreign_key} AS id, COUNT(*) AS total, MIN(id) AS first_id
+                                  FROM Compositions GROUP BY {foreign_key}) AS counts
+                            LEFT JOIN {table} AS lookup ON lookup.id = counts.id''')
+
+    totals, first_ids = {}, {}
+    for name, total, first_id in rows:
+        totals[name] = totals.get(name, 0) + total
+        first_ids[name] = min(first_id, first_ids.get(name, first_id))
+
+    counts = sorted(totals.items(), key=lambda item: (-item[1], first_ids[item[0]]))
+    return counts[:limit] if limit is not None else counts
+
+def count_pairs(conn, x_category, y_category):
+    # Returns (x, y, count) for every combination with both values present, ordered by first appearance of x
+    x_foreign_key, x_table, x_name_column = CATEGORIES[x_category]
+    y_foreign_key, y_table, y_name_column = CATEGORIES[y_category]
+    rows = conn.execute(f'''SELECT x.{x_name_column}, y.{y_name_column}, counts.total, counts.first_id
+                            FROM (SELECT {x_foreign_key} AS x_id, {y_foreign_key} AS y_id, COUNT(*) AS total, MIN(id) AS first_id
+                                  FROM Compositions
+                                  WHERE {x_foreign_key} IS NOT NULL AND {y_foreign_key} IS NOT NULL
+                                  GROUP BY {x_foreign_key}, {y_foreign_key}) AS counts
+                            JOIN {x_table} AS x ON x.id = counts.x_id
+                            JOIN {y_table} AS y ON y.id = counts.y_id''')
+
+    pairs, x_first_ids = [], {}
+    for x_val, y_val, total, first_id in rows:
+        if x_val and y_val:
+            pairs.append((x_val, y_val, total))
+            x_first_ids[x_val] = min(first_id, x_first_ids.get(x_val, first_id))
+
+    pairs.sort(key=lambda pair: x_first_ids[pair[0]])
+    return pairs
+
+def fetch_options(conn, category):
+    # (id, name) pairs for a filter dropdown, sorted by name
+    foreign_key, table, name_column = CATEGORIES[category]
+    return conn.execute(f"SELECT id, {name_column} FROM {table} WHERE {name_column} != '' ORDER BY {name_column}").fetchall()
+
+def match_expression(text, filters):
+    # Every word typed so far must match the start of a word in the title or composer, e.g. "beeth sym" -> "beeth"* "sym"*.
+    # Single letters have no prefix index and would expand to half the vocabulary, so they match whole words only.
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return ""
+    terms = " ".join(f'"{word}"*' if len(word) >= MIN_PREFIX_LENGTH else f'"{word}"' for word in words)
+
+    # Filters are indexed as terms, so the full-text index intersects them with the text in one pass
+    facets = [f'facets : "{FACET_TERMS[category]}{value}"' for category, value in filters.items()]
+    return " AND ".join([f"{{full_name work_title composer}} : ({terms})"] + facets)
+
+def search_compositions(conn, text="", filters=None, after_id=None, before_id=None, limit=25):
+    # Keyset pagination on the composition id: a page starts right after the last id of the previous page,
+    # so every page reads only the rows it shows instead of skipping an OFFSET.
+    # Returns up to `limit` rows ordered by id, and whether more rows follow in the direction of travel.
+    filters = {category: value for category, value in (filters or {}).items() if value is not None}
+    match = match_expression(text, filters)
+    if match:
+        source = "CompositionSearch"
+        id_column = "rowid"
+        conditions, params = ["CompositionSearch MATCH ?"], [match]
+    else:
+        # Without text the filters use the foreign key indexes, which are also ordered by id within each value
+        source = "Compositions"
+        id_column = "id"
+        conditions = [f"{CATEGORIES[category][0]} = ?" for category in filters]
+        params = list(filters.values())
+
+    if before_id is not None:
+        conditions.append(f"{id_column} < ?")
+        params.append(before_id)
+        order = "DESC"
+    else:
+        if after_id is not None:
+            conditions.append(f"{id_column} > ?")
+            params.append(after_id)
+        order = "ASC"
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(f'''SELECT page.id, Compositions.work_title, Compositions.full_name, Composers.full_name,
+                                   Keys.name, Styles.name, Instrumentations.name
+                            FROM (SELECT {id_column} AS id FROM {source} {where} ORDER BY {id_column} {order} LIMIT ?) AS page
+                            JOIN Compositions ON Compositions.id = page.id
+                            LEFT JOIN Composers ON Composers.id = Compositions.composer_id
+                            LEFT JOIN Keys ON Keys.id = Compositions.key_id
+                            LEFT JOIN Styles ON Styles.id = Compositions.piece_style_id
+                            LEFT JOIN Instrumentations ON Instrumentations.id = Compositions.instrumentation_id
+                            ORDER BY page.id {order}''', params + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+    return rows, has_more
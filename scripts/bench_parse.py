@@ -0,0 +1,64 @@
+import argparse
+import glob
+import os
+import time
+
+import scraper
+
+# Constants
+FIXTURES_DIR = "../fixtures"
+REPEAT = 5
+
+def load_pages(fixtures_dir):
+    # Every saved page is benchmarked as a work page or a composer page depending on what it contains
+    work_pages, composer_pages = [], []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        if "wi_body" in html:
+            work_pages.append(html)
+        elif 'catpagejs,{"p1":' in html:
+            composer_pages.append(html)
+    return work_pages, composer_pages
+
+def parse_work_page(html):
+    return scraper.extract_data_mapping(scraper.parse_fragment(html, "wi_body").select(".wi_body table"))
+
+def parse_composer_page(html):
+    header = scraper.parse_fragment(html, "cp_firsth").select(".cp_firsth")
+    return [element.text for element in header], scraper.extract_catpagejs(html, "p1")
+
+def run_path(fast_parse, pages, parse_function, repeat):
+    scraper.FAST_PARSE = fast_parse
+    results = [parse_function(html) for html in pages]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            parse_function(html)
+    elapsed = time.perf_counter() - start
+    return results, len(pages) * repeat / elapsed if elapsed else float("inf")
+
+def benchmark(fixtures_dir, repeat):
+    work_pages, composer_pages = load_pages(fixtures_dir)
+    if not work_pages and not composer_pages:
+        print(f"No fixture pages found in {fixtures_dir}")
+        return
+
+    for label, pages, parse_function in [("work", work_pages, parse_work_page), ("composer", composer_pages, parse_composer_page)]:
+        if not pages:
+            continue
+
+        full_results, full_rate = run_path(False, pages, parse_function, repeat)
+        fast_results, fast_rate = run_path(True, pages, parse_function, repeat)
+
+        print(f"{label} pages: {len(pages)}")
+        print(f"  html.parser: {full_rate:10.1f} pages/s")
+        print(f"  fast path:   {fast_rate:10.1f} pages/s ({fast_rate / full_rate:.1f}x)")
+        print(f"  results match: {full_results == fast_results}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the full and the fast HTML parsing paths on saved pages.")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory with saved *.html pages")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="number of passes over the pages")
+    args = parser.parse_args()
+    benchmark(args.fixtures, args.repeat)
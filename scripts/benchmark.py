@@ -0,0 +1,64 @@
+from contextlib import redirect_stdout, nullcontext
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import scraper
+
+# Constants
+FIXTURES_DIR = "../fixtures"
+STAGES = ["fetch", "parse", "extract", "db"]
+
+def count_rows(db_file_path):
+    with sqlite3.connect(db_file_path) as db:
+        return db.execute("SELECT COUNT(*) FROM Compositions").fetchone()[0]
+
+class UnpacedRateLimiter(scraper.HostRateLimiter):
+    def set_min_interval(self, host, seconds):
+        # The replayed robots.txt Crawl-delay and Request-rate would only measure the sleeps
+        pass
+
+def run_benchmark(fixtures_dir, workers, parsers, quiet=True):
+    # Replays a recorded crawl into a throwaway database with request pacing disabled.
+    # robots.txt is fetched and applied again in every run, so each configuration does the same work.
+    scraper.use_fixtures(fixtures_dir)
+    scraper.WORKERS = workers
+    scraper.PARSE_PROCESSES = parsers
+    scraper.rate_limiter = UnpacedRateLimiter(0)
+    scraper.robots_cache.clear()
+    scraper.stage_times.clear()
+    scraper.stage_counts.clear()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file_path = os.path.join(tmp_dir, "benchmark.db")
+        scraper.connect_database(db_file_path)
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull) if quiet else nullcontext():
+            scraper.create_database()
+            start = time.perf_counter()
+            scraper.scrape_data(scraper.START_URL)
+            elapsed = time.perf_counter() - start
+
+        rows = count_rows(db_file_path)
+
+    pages = scraper.stage_counts["fetch"]
+    print(f"workers: {workers}, parsers: {parsers}")
+    print(f"  total:  {elapsed:8.2f} s")
+    print(f"  pages:  {pages:8d} ({pages / elapsed:.1f} pages/s)")
+    print(f"  rows:   {rows:8d} ({rows / elapsed:.1f} rows/s)")
+    for stage in STAGES:
+        print(f"  {stage + ':':7} {scraper.stage_times[stage]:8.2f} s over {scraper.stage_counts[stage]} calls")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure scraper throughput on a recorded crawl (see scraper.py --record).")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory with recorded pages")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, scraper.WORKERS], help="worker counts to compare")
+    parser.add_argument("--parsers", type=int, nargs="+", default=[scraper.PARSE_PROCESSES], help="parser process counts to compare (0 parses on the main thread)")
+    parser.add_argument("--verbose", action="store_true", help="show the scraper output")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        for parsers in args.parsers:
+            run_benchmark(args.fixtures, workers, parsers, quiet=not args.verbose)
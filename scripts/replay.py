@@ -0,0 +1,95 @@
+from urllib.parse import urldefrag
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+import hashlib
+import json
+import os
+
+# Headers worth keeping with a recorded page; everything else is tied to the original connection
+RECORDED_HEADERS = ["Content-Type", "ETag", "Last-Modified", "Retry-After"]
+
+# Fixture files
+def fixture_name(url):
+    # Fragments never reach the server, so "Category:Composers#fcfrom:Top" and "Category:Composers" share a fixture
+    return hashlib.sha1(urldefrag(url)[0].encode("utf-8")).hexdigest()
+
+def save_fixture(fixtures_dir, response):
+    name = fixture_name(response.request.url)
+    metadata = {
+        "url": response.request.url,
+        "status_code": response.status_code,
+        "headers": {header: response.headers[header] for header in RECORDED_HEADERS if header in response.headers},
+    }
+    with open(os.path.join(fixtures_dir, f"{name}.html"), "wb") as f:
+        f.write(response.content)
+    with open(os.path.join(fixtures_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+
+def load_fixture(fixtures_dir, url):
+    name = fixture_name(url)
+    try:
+        with open(os.path.join(fixtures_dir, f"{name}.json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        with open(os.path.join(fixtures_dir, f"{name}.html"), "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    return metadata, content
+
+# Transport adapters
+class RecordingAdapter(HTTPAdapter):
+    # Talks to the live site and stores every successful page on disk
+    def __init__(self, fixtures_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dir = fixtures_dir
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code < 300:
+            save_fixture(self.fixtures_dir, response)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    # Serves recorded pages from disk; pages that were never recorded come back as 404
+    def __init__(self, fixtures_dir):
+        super().__init__()
+        self.fixtures_dir = fixtures_dir
+
+    def send(self, request, **kwargs):
+        fixture = load_fixture(self.fixtures_dir, request.url)
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.reason = "Replayed"
+
+        if fixture is None:
+            response.status_code = 404
+            response.headers = CaseInsensitiveDict()
+            response._content = b""
+            return response
+
+        metadata, content = fixture
+        response.headers = CaseInsensitiveDict(metadata["headers"])
+        response.encoding = get_encoding_from_headers(response.headers) or "utf-8"
+
+        if self.is_not_modified(request, response.headers):
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = metadata["status_code"]
+            response._content = content
+
+        return response
+
+    def is_not_modified(self, request, headers):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag and request.headers.get("If-None-Match") == etag:
+            return True
+        return bool(last_modified and request.headers.get("If-Modified-Since") == last_modified)
+
+    def close(self):
+        pass
@@ -1,16 +1,28 @@
-import urllib.request
-from urllib.parse import urljoin, quote
+from urllib.parse import urljoin, urlparse, quote
 from urllib import robotparser
 from bs4 import BeautifulSoup
-from collections import namedtuple
+from collections import namedtuple, deque, defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from replay import RecordingAdapter, ReplayAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+import argparse
+import multiprocessing
+import os
 import sqlite3
 import re
 import json
 import requests
 import signal
-import gzip
-import io
 import sys
+import threading
+import time
+
+# metrics.py is shared with the dashboard in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import metrics
 
 # Constants
 CATEGORY_BASE = "Category:"
@@ -22,13 +34,427 @@ URL_BASE = "https://imslp.org/"
 MAIN_URL = f"{URL_BASE}wiki/"
 START_URL = f"{MAIN_URL}{CATEGORY_BASE}{COMPOSERS_TOP_BASE}"
 
+# Number of composition pages fetched in parallel (1 fetches them one at a time)
+WORKERS = 8
+# Upper bound on requests sent to a single host per second (0 disables pacing)
+REQUESTS_PER_SECOND = 2
+# How long a downloaded robots.txt stays valid before it is fetched again, in seconds
+ROBOTS_CACHE_TTL = 24 * 60 * 60
+# A robots.txt that could not be fetched blocks the host only this long before it is tried again, in seconds
+ROBOTS_RETRY_TTL = 60
+ROBOTS_USER_AGENT = "*"
+# Buffered composition rows are written in one transaction every BATCH_SIZE rows or BATCH_SECONDS seconds
+BATCH_SIZE = 500
+BATCH_SECONDS = 5
+LOOKUP_TABLES = ["Keys", "Instrumentations", "Styles", "Languages"]
+LOOKUP_FOREIGN_KEYS = {"Keys": "key_id", "Instrumentations": "instrumentation_id", "Styles": "piece_style_id", "Languages": "language_id"}
+# Applied in order to every lookup value before it is stored. Values that are equal after these rules,
+# ignoring case, share one row, e.g. "voice , piano [1]" is stored as "voice, piano" and found again as "Voice, Piano".
+NORMALIZATION_RULES = [
+    # Footnote references such as [1], [a] or [note 2], and footnote marks
+    (re.compile(r"\[\s*(?:\d+|[a-z]|note\s*\d+)\s*\]", re.IGNORECASE), ""),
+    (re.compile(r"[*†‡]+"), ""),
+    # Single spaces, and one space after each separator but none before it
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\s*([,;])[\s,;]*"), r"\1 "),
+]
+# Words are split the way WordCloud splits text, so the dashboard can draw word clouds from the stored counts
+WORD_PATTERN = re.compile(r"\w[\w']*")
+# Re-crawl every page with conditional requests instead of resuming, so only changed pages are downloaded
+REFRESH = False
+# Cut the few fragments we need out of the raw page before parsing; the full html.parser path is the fallback
+FAST_PARSE = True
+# Processes that parse composition pages while the worker threads keep fetching (0 parses on the main thread)
+PARSE_PROCESSES = os.cpu_count() or 1
+# How often, in seconds, a progress summary with an ETA is printed while scraping
+PROGRESS_SECONDS = 30
+# Seconds to wait for a connection and then for each read, so a hung connection fails instead of stalling the crawl
+REQUEST_TIMEOUT = (10, 30)
+# Failed requests and these statuses are retried with exponential backoff plus up to RETRY_JITTER seconds of jitter;
+# a Retry-After header from the server takes precedence over the backoff
+RETRIES = 5
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 120
+RETRY_JITTER = 1.0
+# Pages that still fail are kept in DeadLetters; --retry-failed gives each one up to this many attempts in total
+DEAD_LETTER_MAX_ATTEMPTS = 5
+
+# Schema migrations, applied in order by migrate_database and tracked in PRAGMA user_version.
+# A step is an SQL statement or a callable that gets the connection.
+MIGRATIONS = [
+    # 1: foreign key and processed-flag indexes, plus covering indexes for the dashboard's GROUP BY queries
+    ["CREATE INDEX IF NOT EXISTS idx_composers_processed ON Composers (processed)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_composer_id ON Compositions (composer_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_key_id ON Compositions (key_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_instrumentation_id ON Compositions (instrumentation_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_language_id ON Compositions (language_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_style_instrumentation ON Compositions (piece_style_id, instrumentation_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_style_composer ON Compositions (piece_style_id, composer_id)",
+     "CREATE INDEX IF NOT EXISTS idx_compositions_style_key ON Compositions (piece_style_id, key_id)"],
+    # 2: full-text index for the dashboard's composition explorer, kept in sync with triggers.
+    # Prefix indexes make type-ahead queries such as "beeth*" a single index lookup, and the explorer's
+    # filters are indexed as terms ("key3 style7") so text and filters intersect inside the index.
+    ["""CREATE VIRTUAL TABLE IF NOT EXISTS CompositionSearch USING fts5
+        (full_name, work_title, composer, facets, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+     """CREATE TRIGGER IF NOT EXISTS compositions_search_insert AFTER INSERT ON Compositions BEGIN
+            INSERT INTO CompositionSearch (rowid, full_name, work_title, composer, facets)
+            VALUES (new.id, new.full_name, new.work_title, (SELECT full_name FROM Composers WHERE id = new.composer_id),
+                    COALESCE('key' || new.key_id, '') || COALESCE(' style' || new.piece_style_id, '') || COALESCE(' instrumentation' || new.instrumentation_id, ''));
+        END""",
+     """CREATE TRIGGER IF NOT EXISTS compositions_search_update
+        AFTER UPDATE OF full_name, work_title, composer_id, key_id, instrumentation_id, piece_style_id ON Compositions BEGIN
+            DELETE FROM CompositionSearch WHERE rowid = old.id;
+            INSERT INTO CompositionSearch (rowid, full_name, work_title, composer, facets)
+            VALUES (new.id, new.full_name, new.work_title, (SELECT full_name FROM Composers WHERE id = new.composer_id),
+                    COALESCE('key' || new.key_id, '') || COALESCE(' style' || new.piece_style_id, '') || COALESCE(' instrumentation' || new.instrumentation_id, ''));
+        END""",
+     """CREATE TRIGGER IF NOT EXISTS compositions_search_delete AFTER DELETE ON Compositions BEGIN
+            DELETE FROM CompositionSearch WHERE rowid = old.id;
+        END""",
+     """INSERT INTO CompositionSearch (rowid, full_name, work_title, composer, facets)
+        SELECT Compositions.id, Compositions.full_name, Compositions.work_title, Composers.full_name,
+               COALESCE('key' || Compositions.key_id, '') || COALESCE(' style' || Compositions.piece_style_id, '') || COALESCE(' instrumentation' || Compositions.instrumentation_id, '')
+        FROM Compositions LEFT JOIN Composers ON Composers.id = Compositions.composer_id"""],
+    # 3: word counts of composer names and work titles for the dashboard's word clouds.
+    # The id keeps words in order of first appearance, which WordCloud uses to break ties.
+    ["""CREATE TABLE IF NOT EXISTS WordCounts
+        (id INTEGER PRIMARY KEY, source TEXT, word TEXT, count INTEGER, UNIQUE (source, word))""",
+     lambda connection: backfill_word_counts(connection)],
+    # 4: pages that failed after all HTTP retries or could not be processed, for a later --retry-failed pass
+    ["""CREATE TABLE IF NOT EXISTS DeadLetters
+        (url TEXT PRIMARY KEY, kind TEXT, name TEXT, composer TEXT, error TEXT, attempts INTEGER DEFAULT 1,
+         first_failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"""],
+    # 5: normalization keys of lookup values and the row each one resolves to. Rows can also be added by hand,
+    # e.g. ("Languages", "deutsch", <id of German>), to merge spellings the rules cannot catch.
+    ["""CREATE TABLE IF NOT EXISTS Aliases
+        (id INTEGER PRIMARY KEY, table_name TEXT, alias TEXT, canonical_id INTEGER, UNIQUE (table_name, alias))""",
+     lambda connection: normalize_lookup_values(connection)],
+    # 6: a counter bumped by every commit that changes the dashboard's data, which the dashboard stamps its caches with.
+    # Reading the database creates its -wal file, so file times and sizes change without a write. The random id tells
+    # apart databases whose counters happen to match.
+    ["CREATE TABLE IF NOT EXISTS DataVersion (id INTEGER PRIMARY KEY CHECK (id = 1), database_id TEXT, version INTEGER)",
+     "INSERT OR IGNORE INTO DataVersion (id, database_id, version) VALUES (1, lower(hex(randomblob(8))), 0)"],
+]
+
 # Namedtuples
 Composer = namedtuple("Composer", ["id", "full_name", "birth_year", "death_year"])
 Composition = namedtuple("Composition", ["id", "full_name", "work_title", "composer", "composer_id", "key_id", "instrumentation_id", "piece_style_id", "language_id"])
+RobotsPolicy = namedtuple("RobotsPolicy", ["parser", "fetched_at", "ttl"])
+Page = namedtuple("Page", ["url", "status_code", "content", "encoding", "etag", "last_modified"])
+FrontierEntry = namedtuple("FrontierEntry", ["url", "name", "status", "etag", "last_modified"])
+DeadLetter = namedtuple("DeadLetter", ["url", "kind", "name", "composer"])
+
+# Rate limiting
+class HostRateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+        self.host_intervals = {}
+
+    def set_min_interval(self, host, seconds):
+        # Slow a host down further, e.g. to honour its robots.txt Crawl-delay
+        with self.lock:
+            self.host_intervals[host] = seconds
+
+    def wait(self, url):
+        # Reserve the next free slot for the host under the lock, then sleep outside of it
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + max(self.interval, self.host_intervals.get(host, 0.0))
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+# HTTP retries
+class CountingRetry(Retry):
+    # urllib3 calls increment for every failed attempt and raises once no retries are left,
+    # so only the attempts that are actually retried reach the counter
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)
+        retries_total.inc()
+        return retry
+
+# Batch writer
+class BatchWriter:
+    def __init__(self, connection, batch_size=BATCH_SIZE, batch_seconds=BATCH_SECONDS):
+        self.conn = connection
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.pending_compositions = []
+        self.pending_processed = []
+        self.pending_discoveries = []
+        self.pending_fetches = []
+        self.pending_dead_letters = []
+        self.pending_words = {"composer": Counter(), "composition": Counter()}
+        self.last_flush = time.monotonic()
+        self.lookup_ids = {table_name: {} for table_name in LOOKUP_TABLES}
+        self.composer_ids = {}
+        self.processed_composers = set()
+        self.saved_compositions = set()
+
+    def load(self):
+        # Warm the name -> id caches so lookups never need a SELECT per row
+        c = self.conn.cursor()
+        for table_name in LOOKUP_TABLES:
+            self.lookup_ids[table_name] = dict(c.execute("SELECT alias, canonical_id FROM Aliases WHERE table_name = ?", (table_name,)))
+        self.composer_ids = dict(c.execute("SELECT full_name, id FROM Composers"))
+        self.processed_composers = {row[0] for row in c.execute("SELECT full_name FROM Composers WHERE processed = 1")}
+        self.saved_compositions = {row[0] for row in c.execute("SELECT full_name FROM Compositions")}
+
+    def insert_returning_id(self, insert_sql, select_sql, params, key):
+        # New rows join the open transaction and are committed by the next flush
+        with timed("db"):
+            cursor = self.conn.execute(insert_sql, params)
+            if cursor.rowcount:
+                return cursor.lastrowid
+            row = self.conn.execute(select_sql, (key,)).fetchone()
+            return row[0] if row else None
+
+    def lookup_id(self, table_name, item_name):
+        # Cached by normalization key, so every spelling of a value resolves to the row of the first one stored
+        key = normalization_key(item_name)
+        if key is None:
+            return None
+        ids = self.lookup_ids[table_name]
+        if key not in ids:
+            name = normalize_value(item_name)
+            ids[key] = self.insert_returning_id(f"INSERT OR IGNORE INTO {table_name} (name) VALUES (?)",
+                                                f"SELECT id FROM {table_name} WHERE name = ?", (name,), name)
+            with timed("db"):
+                self.conn.execute("INSERT OR IGNORE INTO Aliases (table_name, alias, canonical_id) VALUES (?, ?, ?)", (table_name, key, ids[key]))
+        return ids[key]
+
+    def composer_id(self, composer):
+        if composer.full_name not in self.composer_ids:
+            with timed("db"):
+                cursor = self.conn.execute("INSERT OR IGNORE INTO Composers (full_name, birth_year, death_year) VALUES (?, ?, ?)",
+                                           (composer.full_name, composer.birth_year, composer.death_year))
+                if cursor.rowcount:
+                    self.composer_ids[composer.full_name] = cursor.lastrowid
+                    self.pending_words["composer"].update(WORD_PATTERN.findall(composer.full_name))
+                else:
+                    row = self.conn.execute("SELECT id FROM Composers WHERE full_name = ?", (composer.full_name,)).fetchone()
+                    self.composer_ids[composer.full_name] = row[0] if row else None
+        return self.composer_ids[composer.full_name]
+
+    def add_composition(self, composition):
+        composer_id = self.composer_ids.get(composition.composer)
+        if composer_id is None:
+            return
+        self.pending_compositions.append((composition.full_name, composition.work_title, composer_id, composition.key_id,
+                                          composition.instrumentation_id, composition.piece_style_id, composition.language_id))
+        self.saved_compositions.add(composition.full_name)
+        # No flush here: the page's frontier record follows and has to land in the same transaction
+
+    def frontier_entry(self, url):
+        row = self.conn.execute("SELECT url, name, status, etag, last_modified FROM Frontier WHERE url = ?", (url,)).fetchone()
+        return FrontierEntry(*row) if row else None
+
+    def frontier_children(self, parent_url):
+        rows = self.conn.execute("SELECT url, name, status, etag, last_modified FROM Frontier WHERE parent = ?", (parent_url,))
+        return {row[0]: FrontierEntry(*row) for row in rows}
+
+    def discover(self, url, name, parent_url):
+        self.pending_discoveries.append((url, name, parent_url))
+
+    def record_fetch(self, url, status, etag=None, last_modified=None):
+        self.pending_fetches.append((url, status, etag, last_modified))
+        self.maybe_flush()
+
+    def record_dead_letter(self, url, kind, name, composer, error):
+        self.pending_dead_letters.append((url, kind, name, composer, f"{type(error).__name__}: {error}"))
+        self.maybe_flush()
+
+    def dead_letters(self, max_attempts):
+        # Composers first, so their compositions are known again before failed compositions are retried
+        rows = self.conn.execute("SELECT url, kind, name, composer FROM DeadLetters WHERE attempts < ? ORDER BY kind = 'composition', first_failed_at",
+                                 (max_attempts,))
+        return [DeadLetter(*row) for row in rows]
+
+    def mark_processed(self, composer_full_name):
+        # Written in the same transaction as the composer's last compositions so a resume never skips unsaved work
+        self.pending_processed.append((composer_full_name,))
+        self.processed_composers.add(composer_full_name)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if len(self.pending_compositions) >= self.batch_size or time.monotonic() - self.last_flush >= self.batch_seconds:
+            self.flush()
+
+    def count_composition_words(self):
+        # Re-crawled compositions replace their old title, so its words are taken back out first
+        words = self.pending_words["composition"]
+        titles = {row[0]: row[1] for row in self.pending_compositions}
+        names = list(titles)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            for full_name, work_title in self.conn.execute(f"SELECT full_name, work_title FROM Compositions WHERE full_name IN ({','.join('?' * len(chunk))})", chunk):
+                words.subtract(WORD_PATTERN.findall(work_title or ""))
+        for work_title in titles.values():
+            words.update(WORD_PATTERN.findall(work_title or ""))
+
+    def flush(self):
+        with timed("db"), self.conn:
+            c = self.conn.cursor()
+            c.executemany("INSERT OR IGNORE INTO Frontier (url, name, parent) VALUES (?, ?, ?)",
+                          self.pending_discoveries)
+            self.count_composition_words()
+            c.executemany('''INSERT INTO Compositions (full_name, work_title, composer_id, key_id, instrumentation_id, piece_style_id, language_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+                          ON CONFLICT (full_name) DO UPDATE SET work_title = excluded.work_title, composer_id = excluded.composer_id, key_id = excluded.key_id,
+                          instrumentation_id = excluded.instrumentation_id, piece_style_id = excluded.piece_style_id, language_id = excluded.language_id,
+                          updated_at = CURRENT_TIMESTAMP''',
+                          self.pending_compositions)
+            c.executemany('''INSERT INTO Frontier (url, status, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                          ON CONFLICT (url) DO UPDATE SET status = excluded.status, etag = COALESCE(excluded.etag, etag),
+                          last_modified = COALESCE(excluded.last_modified, last_modified), fetched_at = excluded.fetched_at,
+                          updated_at = CURRENT_TIMESTAMP''',
+                          self.pending_fetches)
+            c.executemany("UPDATE Composers SET processed = 1, updated_at = CURRENT_TIMESTAMP WHERE full_name = ?",
+                          self.pending_processed)
+            c.executemany('''INSERT INTO DeadLetters (url, kind, name, composer, error) VALUES (?, ?, ?, ?, ?)
+                          ON CONFLICT (url) DO UPDATE SET error = excluded.error, attempts = attempts + 1, last_failed_at = CURRENT_TIMESTAMP''',
+                          self.pending_dead_letters)
+            c.executemany("DELETE FROM DeadLetters WHERE url = ?",
+                          [(url,) for url, status, etag, last_modified in self.pending_fetches if status == "done"])
+            add_word_counts(c, self.pending_words)
+            if self.pending_compositions or any(self.pending_words.values()):
+                bump_data_version(c)
+        rows_total.inc(len(self.pending_compositions))
+        self.pending_words = {"composer": Counter(), "composition": Counter()}
+        self.pending_compositions = []
+        self.pending_processed = []
+        self.pending_discoveries = []
+        self.pending_fetches = []
+        self.pending_dead_letters = []
+        self.last_flush = time.monotonic()
+
+# Progress
+class ProgressReport:
+    def __init__(self, interval=PROGRESS_SECONDS):
+        self.interval = interval
+        self.total = None
+
+    def start(self, total):
+        self.total = total
+        self.start_time = self.last_report = time.monotonic()
+        # Counters live as long as the process, so a run reports how far they moved since it started
+        self.start_counts = self.counts()
+
+    def counts(self):
+        return composers_total.value(), rows_total.value(), pages_total.total(), errors_total.total()
+
+    def maybe_report(self):
+        if self.total is not None and time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        # The ETA assumes the remaining composers go at the average pace of this run so far
+        self.last_report = time.monotonic()
+        elapsed = self.last_report - self.start_time
+        done, rows, pages, errors = (count - start_count for count, start_count in zip(self.counts(), self.start_counts))
+        eta = format_duration((self.total - done) * elapsed / done) if done else "unknown"
+        print(f"Progress: {done}/{self.total} composers, {rows} compositions written, "
+              f"{pages} pages ({pages / max(elapsed, 1e-9):.1f}/s), {errors} errors, "
+              f"{format_duration(elapsed)} elapsed, ETA {eta}")
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+# Transport
+def configure_session(workers=None):
+    # Called again once --workers is known, so every worker thread can keep a connection open
+    session.mount("http://", HTTPAdapter(**adapter_options(workers)))
+    session.mount("https://", HTTPAdapter(**adapter_options(workers)))
+    # gzip and deflate, plus br when the brotli package is installed
+    session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)["accept-encoding"]
+
+def adapter_options(workers=None):
+    workers = WORKERS if workers is None else workers
+    retry = CountingRetry(total=RETRIES, status_forcelist=RETRY_STATUSES, allowed_methods=["GET", "HEAD"],
+                  backoff_factor=RETRY_BACKOFF, backoff_max=RETRY_BACKOFF_MAX, backoff_jitter=RETRY_JITTER,
+                  respect_retry_after_header=True, raise_on_status=False)
+    # The main thread fetches robots.txt and listing pages next to the workers
+    return {"pool_maxsize": max(workers, 1) + 1, "max_retries": retry}
+
+def use_fixtures(fixtures_dir, record=False):
+    # Route every request, robots.txt included, through recorded pages instead of (or in addition to) the live site
+    adapter = RecordingAdapter(fixtures_dir, **adapter_options()) if record else ReplayAdapter(fixtures_dir)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+# Parser processes
+@contextmanager
+def parser_processes(processes=None):
+    # Started per crawl and stopped when it ends. Spawned processes start clean instead of copying
+    # the fetch threads and the open database connection through fork.
+    global parse_executor
+    processes = PARSE_PROCESSES if processes is None else processes
+    executor = None
+    if processes > 0:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=prepare_parser, initargs=(FAST_PARSE,))
+    parse_executor = executor
+    try:
+        yield
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        parse_executor = None
+
+def prepare_parser(fast_parse):
+    # Runs once in each parser process, which starts with the module defaults
+    global FAST_PARSE
+    FAST_PARSE = fast_parse
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def submit_parse(future):
+    # Hands a fetched page to a parser process; None when it is parsed on this thread or has nothing to parse
+    global parse_executor
+    if parse_executor is None or future.exception() is not None or future.result().status_code == 304:
+        return None
+    try:
+        return parse_executor.submit(parse_composition_page, future.result())
+    except BrokenProcessPool:
+        # Pages already queued fail and go to DeadLetters; the rest of the crawl parses on this thread
+        print("Parser process died; parsing on the main thread.")
+        parse_executor = None
+        return None
+
+def parse_composition_page(page):
+    # Runs in a parser process. Its stage times are sent back with the fields, so the totals include them.
+    stage_times.clear()
+    stage_counts.clear()
+    data_mapping = parse_composition(page_text(page))
+    return data_mapping, dict(stage_times)
 
 # Global variables
 session = requests.Session()
-conn = sqlite3.connect(DB_FILE_PATH)
+configure_session()
+conn = None
+writer = None
+rate_limiter = HostRateLimiter(REQUESTS_PER_SECOND)
+robots_cache = {}
+robots_lock = threading.Lock()
+progress = ProgressReport()
+parse_executor = None
+stage_times = defaultdict(float)
+stage_counts = defaultdict(int)
+stage_lock = threading.Lock()
+
+# Metrics, served with --metrics-port
+stage_seconds = metrics.histogram("scraper_stage_seconds", "Time spent per scraper stage.", ["stage"])
+pages_total = metrics.counter("scraper_pages_total", "Pages fetched, by HTTP status.", ["status"])
+rows_total = metrics.counter("scraper_rows_total", "Composition rows written to the database.")
+composers_total = metrics.counter("scraper_composers_total", "Composers finished in this run.")
+errors_total = metrics.counter("scraper_errors_total", "Failures, by what failed.", ["kind"])
+retries_total = metrics.counter("scraper_retries_total", "HTTP requests sent again after a failed attempt.")
+fetches_in_flight = metrics.gauge("scraper_fetches_in_flight", "HTTP requests currently waiting for a response.")
 
 def exit_program():
     print("Exiting...")
@@ -50,11 +476,37 @@ def signal_handler(sig, frame):
     print("Ctrl+C detected. Exiting.")
     main()
 
-# Set up the signal handler
-signal.signal(signal.SIGINT, signal_handler)
+# Stage timing
+@contextmanager
+def timed(stage):
+    # Wall time is summed per stage, so stages running on worker threads can add up to more than the run time
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage, elapsed):
+    with stage_lock:
+        stage_times[stage] += elapsed
+        stage_counts[stage] += 1
+    stage_seconds.observe(elapsed, stage=stage)
 
 # Database functions
+def connect_database(db_file_path=DB_FILE_PATH):
+    global conn, writer
+    conn = sqlite3.connect(db_file_path)
+    writer = BatchWriter(conn)
+
+def configure_database():
+    # WAL lets readers work while the scraper writes, and NORMAL only fsyncs at checkpoints
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+
 def create_database():
+    configure_database()
     print("Creating database tables if not exist.")
     with conn:
         c = conn.cursor()
@@ -94,113 +546,326 @@ def create_database():
                   FOREIGN KEY (piece_style_id) REFERENCES Styles (id),
                   FOREIGN KEY (language_id) REFERENCES Languages (id))''')
 
+        c.execute('''CREATE TABLE IF NOT EXISTS Frontier
+                  (url TEXT PRIMARY KEY, name TEXT, parent TEXT, status TEXT DEFAULT 'pending',
+                  etag TEXT, last_modified TEXT, fetched_at TIMESTAMP,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        c.execute("CREATE INDEX IF NOT EXISTS idx_frontier_parent ON Frontier (parent)")
+
+    migrate_database()
+
+def migrate_database():
+    schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if version <= schema_version:
+            continue
+
+        print(f"Migrating database to schema version {version}.")
+        with conn:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+        # Fresh statistics let the query planner pick the new indexes
+        conn.execute("ANALYZE")
+
+    if schema_version < len(MIGRATIONS):
+        # Migrations rewrite data the dashboard has cached
+        with conn:
+            bump_data_version(conn)
+
+def bump_data_version(connection):
+    connection.execute("UPDATE DataVersion SET version = version + 1")
+
+def add_word_counts(cursor, word_counts):
+    # word_counts maps a source ("composer" or "composition") to a Counter of word deltas
+    cursor.executemany('''INSERT INTO WordCounts (source, word, count) VALUES (?, ?, ?)
+                       ON CONFLICT (source, word) DO UPDATE SET count = count + excluded.count''',
+                       [(source, word, count) for source, counts in word_counts.items() for word, count in counts.items() if count])
+
+def backfill_word_counts(connection):
+    word_counts = {"composer": Counter(), "composition": Counter()}
+    for (full_name,) in connection.execute("SELECT full_name FROM Composers ORDER BY id"):
+        word_counts["composer"].update(WORD_PATTERN.findall(full_name or ""))
+    for (work_title,) in connection.execute("SELECT work_title FROM Compositions ORDER BY id"):
+        word_counts["composition"].update(WORD_PATTERN.findall(work_title or ""))
+    connection.execute("DELETE FROM WordCounts")
+    add_word_counts(connection.cursor(), word_counts)
+
+def normalize_value(value):
+    # The spelling a lookup value is stored with
+    if value is None:
+        return None
+    for pattern, replacement in NORMALIZATION_RULES:
+        value = pattern.sub(replacement, value)
+    return value.strip(" ,;.:") or None
+
+def normalization_key(value):
+    value = normalize_value(value)
+    return value.casefold() if value is not None else None
+
+def normalize_lookup_values(connection):
+    # Merges lookup rows that share a normalization key, or whose key has an alias, into one row and points
+    # Compositions at it. The oldest row of each group is kept. Can be run again after the rules or Aliases change.
+    for table_name in LOOKUP_TABLES:
+        foreign_key = LOOKUP_FOREIGN_KEYS[table_name]
+        rows = connection.execute(f"SELECT id, name FROM {table_name} ORDER BY id").fetchall()
+        aliases = dict(connection.execute("SELECT alias, canonical_id FROM Aliases WHERE table_name = ?", (table_name,)))
+        row_ids = {row_id for row_id, name in rows}
+        merged_into, first_ids = {}, {}
+
+        def resolve(row_id):
+            while row_id in merged_into:
+                row_id = merged_into[row_id]
+            return row_id
+
+        for row_id, name in rows:
+            key = normalization_key(name)
+            if key is None:
+                # Nothing but footnote marks: the compositions are left without a value
+                merged_into[row_id] = None
+                continue
+            target = aliases.get(key)
+            if target not in row_ids or resolve(target) == row_id:
+                target = first_ids.setdefault(key, row_id)
+            if resolve(target) != row_id:
+                merged_into[row_id] = target
+
+        merged = [(resolve(row_id), row_id) for row_id in merged_into]
+        kept = [(row_id, name) for row_id, name in rows if row_id not in merged_into]
+        connection.executemany(f"UPDATE Compositions SET {foreign_key} = ? WHERE {foreign_key} = ?", merged)
+        connection.executemany("UPDATE Aliases SET canonical_id = ? WHERE table_name = ? AND canonical_id = ?",
+                               [(target, table_name, row_id) for target, row_id in merged])
+        connection.executemany(f"DELETE FROM {table_name} WHERE id = ?", [(row_id,) for target, row_id in merged])
+        connection.executemany(f"UPDATE {table_name} SET name = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND name != ?",
+                               [(normalize_value(name), row_id, normalize_value(name)) for row_id, name in kept])
+        connection.executemany("INSERT OR IGNORE INTO Aliases (table_name, alias, canonical_id) VALUES (?, ?, ?)",
+                               [(table_name, normalization_key(name), row_id) for row_id, name in kept])
+        print(f"Normalized {table_name}: {len(rows)} values -> {len(kept)}.")
+
 # Utility functions
-def get_soup(url):
+def fetch_page(url, frontier_entry=None):
+    # Pages crawled before are requested conditionally; an unchanged page comes back as 304 without a body
+    headers = {}
+    if frontier_entry is not None and frontier_entry.status == "done":
+        if frontier_entry.etag:
+            headers["If-None-Match"] = frontier_entry.etag
+        if frontier_entry.last_modified:
+            headers["If-Modified-Since"] = frontier_entry.last_modified
+
+    rate_limiter.wait(url)
     print(f"Retrieving HTML content from {url}")
-    with session.get(url) as response:
-        html = response.text
-    soup = BeautifulSoup(html, "html.parser")
+    with timed("fetch"), fetches_in_flight.track(), session.get(url, headers=headers, timeout=REQUEST_TIMEOUT) as response:
+        pages_total.inc(status=response.status_code)
+        if response.status_code != 304:
+            response.raise_for_status()
+        # The body stays raw bytes so composition pages can be decoded in a parser process instead of here
+        return Page(url=url, status_code=response.status_code, content=response.content, encoding=response.encoding or response.apparent_encoding,
+                    etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+
+def page_text(page):
+    return str(page.content, page.encoding or "utf-8", errors="replace")
+
+def get_soup(url):
+    soup = BeautifulSoup(page_text(fetch_page(url)), "html.parser")
     return soup
 
+def fetch_concurrently(items, workers=None):
+    # Fetch (name, url, frontier_entry) items on a thread pool and yield (item, future) in input order.
+    # At most `workers * 2` pages are held in flight so memory stays bounded.
+    workers = WORKERS if workers is None else workers
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append((item, executor.submit(fetch_page, item[1], item[2])))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft()
+        while in_flight:
+            yield in_flight.popleft()
+
 # Database checking functions
 def composer_is_saved(full_name):
-    with conn:
-        c = conn.cursor()
-        c.execute("SELECT id FROM Composers WHERE full_name = ?", (full_name,))
-        return c.fetchone() is not None
+    return full_name in writer.composer_ids
 
 def composition_is_saved(full_name):
-    with conn:
-        c = conn.cursor()
-        c.execute("SELECT id FROM Compositions WHERE full_name = ?", (full_name,))
-        return c.fetchone() is not None
+    return full_name in writer.saved_compositions
 
 def composer_is_processed(full_name):
-    with conn:
-        c = conn.cursor()
-        c.execute("SELECT processed FROM Composers WHERE full_name = ?", (full_name,))
-        result = c.fetchone()
-        return result is not None and result[0] == 1
+    return full_name in writer.processed_composers
 
 # Database insertion functions
 def insert_composer(composer):
-    if not composer_is_saved(composer.full_name):
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO Composers (full_name, birth_year, death_year) VALUES (?, ?, ?)",
-                           (composer.full_name, composer.birth_year, composer.death_year))
+    return writer.composer_id(composer)
 
 def insert_composition(composition):
-    with conn:
-        cursor = conn.cursor()
-        composer_id = cursor.execute("SELECT id FROM Composers WHERE full_name = ?", (composition.composer,)).fetchone()
-        if composer_id:
-            composer_id = composer_id[0]
-            cursor.execute("INSERT INTO Compositions (full_name, work_title, composer_id, key_id, instrumentation_id, piece_style_id, language_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                           (composition.full_name, composition.work_title, composer_id, composition.key_id, composition.instrumentation_id, composition.piece_style_id, composition.language_id))
+    writer.add_composition(composition)
 
 def insert_item(table_name, item_name):
     if item_name is None:
         return None
 
-    with conn:
-        cursor = conn.cursor()
+    return writer.lookup_id(table_name, item_name)
+
+# Processing functions
+def process_composer(composer_full_name, composer_link):
+    composer = Composer(id=None, full_name=composer_full_name, birth_year=None, death_year=None)
+    composer_entry = writer.frontier_entry(composer_link)
+    known_compositions = writer.frontier_children(composer_link)
 
-        cursor.execute(f"INSERT OR IGNORE INTO {table_name} (name) VALUES (?)", (item_name,))
-        cursor.execute(f"SELECT id FROM {table_name} WHERE name = ?", (item_name,))
+    if not REFRESH and composer_entry is not None and composer_entry.status == "done" and known_compositions:
+        # Resuming an interrupted composer: its work list was saved when the page was first crawled
+        compositions = [(entry.name, entry.url) for entry in known_compositions.values()]
+    else:
+        composer_page = fetch_page(composer_link, composer_entry)
 
-        item_id = cursor.fetchone()
+        if composer_page.status_code == 304:
+            compositions = [(entry.name, entry.url) for entry in known_compositions.values()]
+        else:
+            composer, compositions = process_composer_page(composer_full_name, composer_link, page_text(composer_page))
 
-        return item_id[0] if item_id else None
+        writer.record_fetch(composer_link, "done", composer_page.etag, composer_page.last_modified)
 
-# Processing functions
-def process_composer(composer_full_name, composer_link):
-    composer_soup = get_soup(composer_link)
-    composer_header = composer_soup.select(".cp_firsth")
-    birth_year, death_year = (extract_birth_death_year(composer_header[0].text) if composer_header else (None, None))
+    pending_compositions = []
+
+    for composition_full_name, composition_link in compositions:
+        composition_entry = known_compositions.get(composition_link)
+
+        if not REFRESH and (composition_is_saved(composition_full_name) or (composition_entry is not None and composition_entry.status == "done")):
+            continue
+
+        if not is_scraping_allowed(composition_link):
+            print(f"Skipping composition: {composition_full_name} (Disallowed by robots.txt)")
+            continue
+
+        pending_compositions.append((composition_full_name, composition_link, composition_entry))
+
+    process_compositions(composer, pending_compositions)
+
+def process_compositions(composer, pending_compositions):
+    # Worker threads fetch, parser processes parse and this thread writes, each stage working on different pages.
+    # Pages wait for a parser in a queue of at most `PARSE_PROCESSES * 2`, so when parsing falls behind
+    # the fetchers stop instead of piling up pages; results are written in the order the pages were listed.
+    parsing = deque()
+    for item, future in fetch_concurrently(pending_compositions):
+        parsing.append((item, future, submit_parse(future)))
+        if len(parsing) >= max(PARSE_PROCESSES, 1) * 2:
+            save_composition_page(composer, *parsing.popleft())
+    while parsing:
+        save_composition_page(composer, *parsing.popleft())
+
+def save_composition_page(composer, item, future, parse_future):
+    composition_full_name, composition_link, composition_entry = item
+    print(f"Processing composition: {composition_full_name}")
+
+    try:
+        composition_page = future.result()
+
+        if composition_page.status_code == 304:
+            print(f"Skipping composition: {composition_full_name} (Not Modified)")
+        elif parse_future is None:
+            process_composition(composer, composition_full_name, page_text(composition_page))
+        elif REFRESH or not composition_is_saved(composition_full_name):
+            data_mapping, parse_times = parse_future.result()
+            for stage, elapsed in parse_times.items():
+                record_stage(stage, elapsed)
+            save_composition(composer, composition_full_name, data_mapping)
+
+        writer.record_fetch(composition_link, "done", composition_page.etag, composition_page.last_modified)
+
+    except Exception as comp_err:
+        print(f"Error processing composition {composition_full_name}: {comp_err}")
+        errors_total.inc(kind="composition")
+        writer.record_dead_letter(composition_link, "composition", composition_full_name, composer.full_name, comp_err)
+        writer.record_fetch(composition_link, "failed")
+
+    finally:
+        progress.maybe_report()
+
+def process_composer_page(composer_full_name, composer_link, composer_html):
+    with timed("parse"):
+        composer_header = parse_fragment(composer_html, "cp_firsth").select(".cp_firsth")
+        birth_year, death_year = (extract_birth_death_year(composer_header[0].text) if composer_header else (None, None))
     composer = Composer(id=None, full_name=composer_full_name, birth_year=birth_year, death_year=death_year)
     insert_composer(composer)
 
+    compositions = []
+
     if is_scraping_allowed(MAIN_URL):
-        compositions_script_tag = composer_soup.find("script", string=re.compile("catpagejs"))
-        compositions_script_str = str(compositions_script_tag)
-        compositions_pattern = re.compile(r'catpagejs,{"p1":(.*?)}\);')
-        compositions_match = compositions_pattern.search(compositions_script_str)
-        compositions_data_str = compositions_match.group(1)
-        compositions_data = json.loads(compositions_data_str)
-
-        for composition_letter, compositions in compositions_data.items():
-            for composition_full_name in compositions:
-                print(f"Processing composition: {composition_full_name}")
-                composition_full_name = composition_full_name.split("|")[0]
+        with timed("parse"):
+            compositions_data = extract_catpagejs(composer_html, "p1")
 
+        for composition_letter, composition_names in compositions_data.items():
+            for composition_full_name in composition_names:
+                composition_full_name = composition_full_name.split("|")[0]
                 composition_link = MAIN_URL + quote(composition_full_name.replace(" ", "_"))
-                
-                try:
-                    process_composition(composer, composition_full_name, composition_link)
+                writer.discover(composition_link, composition_full_name, composer_link)
+                compositions.append((composition_full_name, composition_link))
 
-                except Exception as comp_err:
-                    print(f"Error processing composition {composition_full_name}: {comp_err}")
-                    continue
+    return composer, compositions
 
-def process_composition(composer, composition_full_name, composition_link):
-    with conn:
-        if not composition_is_saved(composition_full_name):
-            composition_soup = get_soup(composition_link)
+def process_composition(composer, composition_full_name, composition_html):
+    if REFRESH or not composition_is_saved(composition_full_name):
+        save_composition(composer, composition_full_name, parse_composition(composition_html))
 
-            general_info_table = composition_soup.select(".wi_body table")
-    
-            data_mapping = extract_data_mapping(general_info_table)
+def parse_composition(composition_html):
+    with timed("parse"):
+        composition_soup = parse_fragment(composition_html, "wi_body")
+
+        general_info_table = composition_soup.select(".wi_body table")
+
+        with timed("extract"):
+            return extract_data_mapping(general_info_table)
 
-            key_id = insert_item("Keys", data_mapping["Key"])
-            instrumentation_id = insert_item("Instrumentations", data_mapping["Instrumentation"])
-            piece_style_id = insert_item("Styles", data_mapping["Piece Style"])
-            language_id = insert_item("Languages", data_mapping["Language"])
+def save_composition(composer, composition_full_name, data_mapping):
+    # Lookup ids come from the batch writer, so only this thread turns parsed fields into a Composition
+    key_id = insert_item("Keys", data_mapping["Key"])
+    instrumentation_id = insert_item("Instrumentations", data_mapping["Instrumentation"])
+    piece_style_id = insert_item("Styles", data_mapping["Piece Style"])
+    language_id = insert_item("Languages", data_mapping["Language"])
 
-            composition = Composition(id=None, full_name=composition_full_name, work_title=data_mapping['Work Title'], composer=composer.full_name, composer_id=None, key_id=key_id, instrumentation_id=instrumentation_id, piece_style_id=piece_style_id, language_id=language_id)
-            insert_composition(composition)
+    composition = Composition(id=None, full_name=composition_full_name, work_title=data_mapping['Work Title'], composer=composer.full_name, composer_id=None, key_id=key_id, instrumentation_id=instrumentation_id, piece_style_id=piece_style_id, language_id=language_id)
+    insert_composition(composition)
 
 # Extracting functions
+def extract_fragment(html, class_name):
+    # Slice the first element carrying `class_name` out of the raw page by balancing its tags
+    start_match = re.search(rf'<(\w+)[^>]*\bclass=["\'][^"\']*\b{class_name}\b', html)
+    if start_match is None:
+        return None
+
+    tag_pattern = re.compile(rf'<(/?){start_match.group(1)}\b', re.IGNORECASE)
+    depth = 0
+    for tag_match in tag_pattern.finditer(html, start_match.start()):
+        depth += -1 if tag_match.group(1) else 1
+        if depth == 0:
+            end = html.find(">", tag_match.end())
+            return html[start_match.start():end + 1] if end != -1 else None
+
+    return None
+
+def parse_fragment(html, class_name):
+    fragment = extract_fragment(html, class_name) if FAST_PARSE else None
+    if fragment is None:
+        return BeautifulSoup(html, "html.parser")
+    return BeautifulSoup(fragment, "html.parser")
+
+def extract_catpagejs(html, list_key):
+    # The category listing is a JSON literal inside a script tag, so a regex over the raw page finds it directly
+    catpagejs_pattern = re.compile(r'catpagejs,{"%s":(.*?)}\);' % list_key)
+    catpagejs_match = catpagejs_pattern.search(html) if FAST_PARSE else None
+
+    if catpagejs_match is None:
+        script_tag = BeautifulSoup(html, "html.parser").find("script", string=re.compile("catpagejs"))
+        catpagejs_match = catpagejs_pattern.search(str(script_tag))
+
+    return json.loads(catpagejs_match.group(1))
+
 def extract_text(element):
     if hasattr(element, 'get'):
         if 'ms555' in element.get('class', []):
@@ -239,29 +904,57 @@ def extract_birth_death_year(text):
     
     return birth_year, death_year
 
-# Check for robots.txt 
-def is_scraping_allowed(target_url):
+# Check for robots.txt
+def fetch_robots_policy(host_url):
     rp = robotparser.RobotFileParser()
-    robots_url = urljoin(URL_BASE, '/robots.txt')
-    request = urllib.request.Request(robots_url, headers={'Accept-Encoding': 'gzip'})
+    robots_url = urljoin(host_url, '/robots.txt')
+    ttl = ROBOTS_CACHE_TTL
 
+    # Like RobotFileParser.read: a missing robots.txt allows everything, a forbidden one disallows everything.
+    # Server and network errors say nothing about the rules, so they disallow until the next attempt shortly after
     try:
-        with urllib.request.urlopen(request) as response:
-            content_encoding = response.info().get('Content-Encoding')
-            if content_encoding == 'gzip':
-                with gzip.GzipFile(fileobj=io.BytesIO(response.read())) as f:
-                    data = f.read().decode('utf-8')
+        with session.get(robots_url, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code in (401, 403):
+                rp.disallow_all = True
+            elif 400 <= response.status_code < 500:
+                rp.allow_all = True
+            elif response.status_code >= 500:
+                print(f"Error fetching {robots_url}: status {response.status_code}")
+                errors_total.inc(kind="robots")
+                rp.disallow_all = True
+                ttl = ROBOTS_RETRY_TTL
             else:
-                data = response.read().decode('utf-8')
-
-        rp.parse(data.splitlines())
-        return rp.can_fetch('*', target_url)
-    except urllib.error.URLError as e:
+                rp.parse(response.text.splitlines())
+    except requests.RequestException as e:
         print(f"Error fetching {robots_url}: {e}")
-        return False
+        errors_total.inc(kind="robots")
+        rp.disallow_all = True
+        ttl = ROBOTS_RETRY_TTL
+
+    return RobotsPolicy(parser=rp, fetched_at=time.monotonic(), ttl=ttl)
+
+def apply_crawl_rate(host, rp):
+    # Feed Crawl-delay and Request-rate into the per-host request pacing
+    intervals = [rp.crawl_delay(ROBOTS_USER_AGENT) or 0]
+    request_rate = rp.request_rate(ROBOTS_USER_AGENT)
+    if request_rate and request_rate.requests:
+        intervals.append(request_rate.seconds / request_rate.requests)
+    rate_limiter.set_min_interval(host, float(max(intervals)))
+
+def get_robots_policy(target_url):
+    # robots.txt is downloaded once per host and reused until its policy's ttl expires
+    parsed_url = urlparse(target_url)
+    host = parsed_url.netloc
+    with robots_lock:
+        policy = robots_cache.get(host)
+        if policy is None or time.monotonic() - policy.fetched_at > policy.ttl:
+            policy = fetch_robots_policy(f"{parsed_url.scheme}://{host}/")
+            robots_cache[host] = policy
+            apply_crawl_rate(host, policy.parser)
+    return policy
 
-    rp.parse(data.splitlines())
-    return rp.can_fetch('*', target_url)
+def is_scraping_allowed(target_url):
+    return get_robots_policy(target_url).parser.can_fetch(ROBOTS_USER_AGENT, target_url)
 
 # Main function
 def scrape_data(url):
@@ -271,15 +964,11 @@ def scrape_data(url):
         print("Scraping is not allowed for this website. Exiting.")
         exit_program()
 
-    soup = get_soup(url)
+    writer.load()
+    html = page_text(fetch_page(url))
 
     try:
-        composers_script_tag = soup.find("script", string=re.compile("catpagejs"))
-        composers_script_str = str(composers_script_tag)
-        composers_pattern = re.compile(r'catpagejs,{"s1":(.*?)}\);')
-        composers_match = composers_pattern.search(composers_script_str)
-        composers_data_str = composers_match.group(1)
-        composers_data = json.loads(composers_data_str)
+        composers_data = extract_catpagejs(html, "s1")
 
         exclude_names=["collections", "various", "traditional"]
 
@@ -289,6 +978,8 @@ def scrape_data(url):
             print("Scraping is not allowed for composers. Exiting.")
             exit_program()
 
+        pending_composers = []
+
         for composer_letter, composers in composers_data.items():
             for composer_full_name in composers:
 
@@ -296,31 +987,134 @@ def scrape_data(url):
                     print(f"Skipping composer: {composer_full_name} (Excluded)")
                     continue
 
-                if composer_is_processed(composer_full_name):
+                if not REFRESH and composer_is_processed(composer_full_name):
                     print(f"Skipping composer: {composer_full_name} (Already Processed)")
                     continue
 
+                pending_composers.append(composer_full_name)
+
+        # Known up front, so the progress summary can estimate the time left
+        progress.start(len(pending_composers))
+
+        with parser_processes():
+            for composer_full_name in pending_composers:
                 print(f"Processing composer: {composer_full_name}")
 
                 composer_link = composer_link_base + quote(composer_full_name.replace(" ", "_"))
 
+                if not is_scraping_allowed(composer_link):
+                    print(f"Skipping composer: {composer_full_name} (Disallowed by robots.txt)")
+                    composers_total.inc()
+                    continue
+
                 try:
                     process_composer(composer_full_name, composer_link)
 
                 except Exception as comp_err:
                     print(f"Error processing composer {composer_full_name}: {comp_err}")
-                    pass
+                    errors_total.inc(kind="composer")
+                    writer.record_dead_letter(composer_link, "composer", composer_full_name, composer_full_name, comp_err)
+
+                writer.mark_processed(composer_full_name)
+                composers_total.inc()
+                progress.maybe_report()
 
-                with conn:
-                    cursor = conn.cursor()
-                    cursor.execute("UPDATE Composers SET processed = 1, updated_at = CURRENT_TIMESTAMP WHERE full_name = ?", (composer_full_name,))
-            
     except Exception as err:
         print(f"Error scraping data from {url}: {err}")
+        errors_total.inc(kind="scrape")
+
+    finally:
+        writer.flush()
+        conn.close()
+        if progress.total is not None:
+            progress.report()
+
+def retry_dead_letters():
+    # Gives every page in DeadLetters another try; pages that work are taken off the list when their fetch is recorded
+    writer.load()
+    dead_letters = writer.dead_letters(DEAD_LETTER_MAX_ATTEMPTS)
+    print(f"Retrying {len(dead_letters)} failed pages.")
+
+    try:
+        with parser_processes():
+            for dead_letter in dead_letters:
+                if dead_letter.kind != "composer" or not is_scraping_allowed(dead_letter.url):
+                    continue
+                print(f"Retrying composer: {dead_letter.name}")
+                try:
+                    process_composer(dead_letter.name, dead_letter.url)
+                    # A composer resumed from Frontier is not fetched again, so its retry is recorded here
+                    writer.record_fetch(dead_letter.url, "done")
+                except Exception as comp_err:
+                    print(f"Error processing composer {dead_letter.name}: {comp_err}")
+                    errors_total.inc(kind="composer")
+                    writer.record_dead_letter(dead_letter.url, "composer", dead_letter.name, dead_letter.composer, comp_err)
+                writer.mark_processed(dead_letter.name)
+
+            compositions_by_composer = defaultdict(list)
+            for dead_letter in dead_letters:
+                if dead_letter.kind == "composition" and is_scraping_allowed(dead_letter.url):
+                    compositions_by_composer[dead_letter.composer].append((dead_letter.name, dead_letter.url, None))
+
+            for composer_full_name, pending_compositions in compositions_by_composer.items():
+                composer = Composer(id=None, full_name=composer_full_name, birth_year=None, death_year=None)
+                process_compositions(composer, pending_compositions)
 
     finally:
+        writer.flush()
+        remaining = conn.execute("SELECT COUNT(*) FROM DeadLetters").fetchone()[0]
         conn.close()
+        print(f"{remaining} pages are still failing.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape composers and compositions from IMSLP into SQLite.")
+    parser.add_argument("--db", default=DB_FILE_PATH, help="SQLite database file")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="composition pages fetched in parallel")
+    parser.add_argument("--parsers", type=int, default=PARSE_PROCESSES, help="processes parsing composition pages (0 parses on the main thread)")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="requests per second per host (0 disables pacing)")
+    parser.add_argument("--refresh", action="store_true", default=REFRESH, help="re-crawl with conditional requests")
+    parser.add_argument("--migrate", action="store_true", help="only create and migrate the database schema, then exit")
+    parser.add_argument("--normalize", action="store_true", help="only merge lookup values again after NORMALIZATION_RULES or Aliases changed, then exit")
+    parser.add_argument("--retry-failed", action="store_true", help="only retry the pages recorded in DeadLetters, then exit")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port while scraping")
+    parser.add_argument("--progress", type=float, default=PROGRESS_SECONDS, help="seconds between progress summaries")
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument("--record", metavar="DIR", help="store every fetched page in DIR")
+    fixtures.add_argument("--replay", metavar="DIR", help="serve pages from DIR instead of the live site")
+    return parser.parse_args()
 
 # Main execution
-create_database()
-scrape_data(START_URL)
\ No newline at end of file
+if __name__ == "__main__":
+    args = parse_args()
+    WORKERS = args.workers
+    PARSE_PROCESSES = args.parsers
+    REFRESH = args.refresh
+    rate_limiter = HostRateLimiter(args.rate)
+    progress = ProgressReport(args.progress)
+    configure_session(args.workers)
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    if args.record or args.replay:
+        use_fixtures(args.record or args.replay, record=bool(args.record))
+
+    # Set up the signal handler
+    signal.signal(signal.SIGINT, signal_handler)
+
+    connect_database(args.db)
+    create_database()
+
+    if args.migrate:
+        exit_program()
+
+    if args.normalize:
+        with conn:
+            normalize_lookup_values(conn)
+            bump_data_version(conn)
+        exit_program()
+
+    if args.retry_failed:
+        retry_dead_letters()
+    else:
+        scrape_data(START_URL)
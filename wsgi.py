@@ -0,0 +1,9 @@
+import os
+
+import harmony
+
+# WSGI application for production servers: gunicorn -c gunicorn.conf.py wsgi:application
+# Set HARMONY_ARTIFACTS_DIR to serve only the artifacts built by build_artifacts.py,
+# and HARMONY_PROFILE to a comma-separated list of callbacks to profile
+harmony.PROFILE_CALLBACKS.update(filter(None, os.environ.get("HARMONY_PROFILE", "").split(",")))
+application = harmony.create_server(artifacts_dir=os.environ.get("HARMONY_ARTIFACTS_DIR") or harmony.ARTIFACTS_DIR)